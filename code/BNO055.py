@@ -10,9 +10,10 @@
 """
 
 # import modules
-import machine
+import os
 import time
 import struct
+from array import array
 
 # BNO055 register addresses
 dev_addr = 0x28              # Default I2C address for the BNO055
@@ -25,6 +26,12 @@ mag_offset_addr = 0x5C       # Register address for magnetometer offsets
 gyr_offset_addr = 0x62       # Register address for gyroscope offsets
 unit_addr = 0x3B             # Register address for unit selection
 
+# Calibration profile file format
+profile_magic = b'BNOC'      # Identifies a calibration profile file
+profile_version = 1          # Version of the profile file layout
+profile_header = '<4sB16sL'  # Magic, version, profile name, save time in seconds
+profile_len = 22             # Number of offset and radius bytes stored in a profile
+
 # BNO055 mode numbers
 imu_modes = {
     'imuplus': 0x08,          # IMU mode without magnetometer
@@ -48,8 +55,19 @@ class BNO055:
         @param i2c A pre-configured I2C object for communicating with the IMU.
         '''
         self.imu = i2c
+        self.mode_name = 'config'
         self.mode_number = imu_modes['config']  # Start in configuration mode
 
+        # Preallocate read buffers so sensor reads do not allocate memory
+        self._cal_status_buf = bytearray(1)     # Buffer for the calibration status byte
+        self._euler_buf = bytearray(6)          # Buffer for Euler angle data
+        self._gyr_buf = bytearray(6)            # Buffer for gyroscope data
+        self._burst_buf = bytearray(12)         # Buffer for gyroscope and Euler angle data
+
+        # Raw readings, kept as integers in the IMU's units so reads do not make float objects
+        self.gyr = array('h', [0]*3)            # x, y, z angular velocity [1/16 deg/s]
+        self.euler = array('h', [0]*3)          # heading, roll, pitch [1/16 deg]
+
     def set_opr_mode(self, mode):
         '''!@brief Sets the operating mode of the IMU.
         @details Changes the mode of the BNO055 IMU to one of the supported modes, such as NDOF or IMUPLUS.
@@ -64,7 +82,7 @@ class BNO055:
         '''!@brief Reads the calibration status of the IMU.
         @details Retrieves the calibration levels of the system, gyroscope, accelerometer, and magnetometer.
         '''
-        buf = bytearray(1)                     # Initialize a single-byte buffer
+        buf = self._cal_status_buf             # Use the preallocated single-byte buffer
         self.imu.readfrom_mem_into(dev_addr, cal_status_addr, buf)  # Read the calibration status byte
         cal_status = buf[0]
         # Parse the status byte to retrieve individual calibration levels
@@ -96,27 +114,182 @@ class BNO055:
         self.imu.writeto_mem(dev_addr, acc_offset_addr, buf)  # Write offsets to the IMU
         self.set_opr_mode(last_mode)            # Restore the previous mode
 
+    def save_profile(self, name='default'):
+        '''!@brief Saves the calibration coefficients to a named profile file.
+        @details The file holds a header with the file version, profile name and save time,
+                 then the 22 offset and radius bytes, then a CRC of everything before it.
+        @param name The name of the profile, up to 16 characters.
+        '''
+        last_mode = self.mode_name              # Save the current mode
+        self.set_opr_mode('config')             # Switch to configuration mode
+        time.sleep(0.02)                        # Wait for the mode switch to finish
+        buf = bytearray(profile_len)            # Initialize a buffer for calibration data
+        self.imu.readfrom_mem_into(dev_addr, acc_offset_addr, buf)  # Read offsets into buffer
+        self.set_opr_mode(last_mode)            # Restore the previous mode
+        time.sleep(0.01)                        # Wait for the mode switch to finish
+
+        data = struct.pack(profile_header, profile_magic, profile_version,
+                           name.encode(), int(time.time())) + buf
+        with open(profile_file(name), 'wb') as file:
+            file.write(data)                    # Save header and calibration data
+            file.write(struct.pack('<H', crc16(data)))  # Save the CRC
+
+    def load_profile(self, name='default'):
+        '''!@brief Validates a named profile file and applies it to the IMU.
+        @details The file is fully checked before the IMU is touched. The offsets are then
+                 written and read back during a single switch into configuration mode.
+        @param name The name of the profile to load.
+        @return The time the profile was saved, in seconds.
+        @exception OSError if the profile file does not exist or the offsets read back
+                   from the IMU do not match the profile.
+        @exception ValueError if the profile file is damaged or from another version.
+        '''
+        filename = profile_file(name)
+        with open(filename, 'rb') as file:
+            data = file.read()                  # Read the whole profile file
+
+        # Check the layout, identity and integrity of the file
+        head_len = struct.calcsize(profile_header)
+        if len(data) != head_len + profile_len + 2:
+            raise ValueError(f'{filename} has the wrong length')
+        magic, version, _, saved = struct.unpack_from(profile_header, data)
+        if magic != profile_magic:
+            raise ValueError(f'{filename} is not a calibration profile')
+        if version != profile_version:
+            raise ValueError(f'{filename} is profile version {version}, expected {profile_version}')
+        crc, = struct.unpack_from('<H', data, head_len + profile_len)
+        if crc != crc16(data[:head_len + profile_len]):
+            raise ValueError(f'{filename} failed its CRC check')
+
+        self.apply_offsets(data[head_len:head_len + profile_len])
+        return saved
+
+    def convert_legacy(self, name='default', filename='calibration.bin'):
+        '''!@brief Converts a calibration file saved by read_cal_coef() into a named profile.
+        @details Files saved before profiles were added hold only the 22 offset and radius
+                 bytes. The offsets are applied to the IMU and confirmed, then saved as a
+                 profile, so boards calibrated with the old file keep their calibration.
+        @param name The name of the profile to save.
+        @param filename The name of the old calibration file.
+        @return True if a calibration was converted, False if there is no old calibration file.
+        @exception OSError if the offsets read back from the IMU do not match the file.
+        @exception ValueError if the old calibration file has the wrong length.
+        '''
+        try:
+            with open(filename, 'rb') as file:
+                offsets = file.read()           # Read the raw offsets
+        except OSError:
+            return False
+        if len(offsets) != profile_len:
+            raise ValueError(f'{filename} has the wrong length')
+
+        self.apply_offsets(offsets)
+        self.save_profile(name)
+        return True
+
+    def apply_offsets(self, offsets):
+        '''!@brief Writes calibration coefficients to the IMU and confirms them.
+        @details Switches into configuration mode once, writes the offsets, reads them back
+                 and restores the previous mode.
+        @param offsets The 22 offset and radius bytes to write.
+        @exception OSError if the offsets read back do not match.
+        '''
+        last_mode = self.mode_name              # Save the current mode
+        self.set_opr_mode('config')             # Switch to configuration mode
+        time.sleep(0.02)                        # Wait for the mode switch to finish
+        self.imu.writeto_mem(dev_addr, acc_offset_addr, offsets)  # Write offsets to the IMU
+        check = bytearray(profile_len)          # Initialize a buffer for the read back
+        self.imu.readfrom_mem_into(dev_addr, acc_offset_addr, check)  # Read offsets back
+        self.set_opr_mode(last_mode)            # Restore the previous mode
+        time.sleep(0.01)                        # Wait for the mode switch to finish
+        if check != offsets:
+            raise OSError('IMU offsets read back do not match the calibration profile')
+
     def read_euler(self):
         '''!@brief Reads Euler angles from the IMU.
-        @details Retrieves the heading, roll, and pitch angles for orientation feedback.
+        @details Retrieves the heading, roll, and pitch angles for orientation feedback into
+                 the euler array, in units of 1/16 degree, without allocating memory.
         '''
-        buf = bytearray(6)                      # Initialize a buffer for Euler angle data
+        buf = self._euler_buf                   # Use the preallocated Euler angle buffer
         self.imu.readfrom_mem_into(dev_addr, euler_addr, buf)  # Read data into the buffer
-        # Unpack the data into individual angles
-        self.euler_heading, self.euler_roll, self.euler_pitch = struct.unpack('<hhh', buf)
-        self.euler_heading /= 16               # Convert heading to degrees
+        unpack_into(buf, 0, self.euler)         # Decode the angles in place
 
     def read_gyr(self):
         '''!@brief Reads angular velocity from the IMU.
-        @details Retrieves the angular velocity in x, y, and z axes.
+        @details Retrieves the angular velocity in x, y, and z axes into the gyr array, in
+                 units of 1/16 degree per second, without allocating memory.
         '''
-        buf = bytearray(6)                      # Initialize a buffer for gyroscope data
+        buf = self._gyr_buf                     # Use the preallocated gyroscope buffer
         self.imu.readfrom_mem_into(dev_addr, gyr_addr, buf)  # Read data into the buffer
-        # Unpack the data into individual axes
-        self.gyr_x, self.gyr_y, self.gyr_z = struct.unpack('<hhh', buf)
-        self.gyr_z /= 16                        # Convert yaw rate to degrees/second
+        unpack_into(buf, 0, self.gyr)           # Decode the axes in place
+
+    def read_gyr_euler(self):
+        '''!@brief Reads angular velocity and Euler angles from the IMU in one transaction.
+        @details The gyroscope registers (0x14-0x19) are directly followed by the Euler angle
+                 registers (0x1A-0x1F), so the whole block is read with a single I2C transfer
+                 into a preallocated buffer and decoded in place into the gyr and euler
+                 arrays. This replaces a call to read_gyr() followed by a call to read_euler().
+        '''
+        buf = self._burst_buf                   # Use the preallocated burst buffer
+        self.imu.readfrom_mem_into(dev_addr, gyr_addr, buf)  # Read gyro through Euler registers
+        unpack_into(buf, 0, self.gyr)           # Decode the axes in place
+        unpack_into(buf, 6, self.euler)         # Decode the angles in place
+
+    @property
+    def gyr_z(self):
+        '''!@brief The last yaw rate read, in degrees per second.
+        @details Scaling makes a float object, so code which must not allocate memory
+                 reads gyr[2] in units of 1/16 degree per second instead.
+        '''
+        return self.gyr[2] / 16
+
+    @property
+    def euler_heading(self):
+        '''!@brief The last heading read, in degrees.
+        @details Scaling makes a float object, so code which must not allocate memory
+                 reads euler[0] in units of 1/16 degree instead.
+        '''
+        return self.euler[0] / 16
+
+def unpack_into(buf, start, values):
+    '''!@brief Decodes little-endian signed 16-bit values from a buffer without allocating memory.
+    @param buf The bytes read from the IMU.
+    @param start The index in buf of the first value.
+    @param values The array into which the values are decoded, one per two bytes.
+    '''
+    for idx in range(len(values)):
+        value = buf[start + 2*idx] | buf[start + 2*idx + 1] << 8
+        if value & 0x8000:
+            value -= 0x10000
+        values[idx] = value
+
+def profile_file(name):
+    '''!@brief Gets the file name used to store a named calibration profile.
+    @param name The name of the profile.
+    '''
+    return f'imu_{name}.cal'
+
+def list_profiles():
+    '''!@brief Lists the names of the calibration profiles saved on the board.
+    '''
+    return [file[4:-4] for file in os.listdir() if file.startswith('imu_') and file.endswith('.cal')]
+
+def crc16(data):
+    '''!@brief Calculates the CRC-16/CCITT-FALSE checksum of a block of bytes.
+    @param data The bytes to check.
+    '''
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
 
 if __name__ == '__main__':
+    import machine
     i2c1 = machine.I2C(1)  # Configure I2C on pins B8 (SCL) and B9 (SDA)
     IMU = BNO055(i2c1)     # Initialize the IMU
     IMU.set_opr_mode('ndof')  # Set the IMU to NDOF mode
@@ -0,0 +1,206 @@
+"""!
+@file BNO055_emulator.py
+@brief An in-process emulator of the BNO055 register map for running the IMU driver on a PC.
+@details Objects of the emulator class stand in for the I2C object given to the BNO055
+         driver. Register reads and writes act on an emulated register map which holds the
+         operation mode, calibration status, offset registers, and gyroscope and Euler angle
+         data generated from a motion profile. Time is kept on a virtual clock which only
+         moves when the emulator is told to advance it or when a bus transfer is charged
+         its configured latency, so tests and benchmarks run faster than real time.
+         Run this file with CPython or MicroPython's Unix port to drive the BNO055 driver
+         and the heading estimator through a scripted turn.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import struct
+from BNO055 import (dev_addr, gyr_addr, euler_addr, cal_status_addr, mode_addr,
+                    acc_offset_addr, imu_modes)
+
+# emulated register map size and the span of the offset and radius registers
+reg_count = 0x80
+offset_len = 22
+
+class scripted_motion:
+    '''!@brief A motion profile made of constant yaw rate segments.
+    @details Each segment is a (duration [s], yaw rate [deg/s]) pair. After the last
+             segment the robot stays still.
+    '''
+
+    def __init__(self, segments):
+        '''!@brief Creates the motion profile from a list of segments.
+        @param segments list of (duration [s], yaw rate [deg/s]) pairs
+        '''
+        self.segments = segments
+
+    def __call__(self, time_s):
+        '''!@brief Gets the yaw rate at a given time.
+        @param time_s time since the start of the profile [s]
+        @return The yaw rate at that time [deg/s]
+        '''
+        for duration, yaw_rate in self.segments:
+            if time_s < duration:
+                return yaw_rate
+            time_s -= duration
+        return 0
+
+class BNO055_emulator:
+    '''!@brief An emulated BNO055 which can be used in place of an I2C object.
+    @details Supports the readfrom_mem_into(), readfrom_mem() and writeto_mem() calls the
+             BNO055 driver makes. Sensor data follows the motion profile while the chip
+             is in a fusion mode and is frozen in configuration mode, and offset registers
+             only accept writes in configuration mode, as on the real chip.
+    '''
+
+    def __init__(self, motion=None, heading=0.0, cal_status=(3, 3, 3, 3),
+                 latency_us=0, byte_us=0, step_us=1000):
+        '''!@brief Creates the emulated chip in configuration mode.
+        @param motion function giving the yaw rate [deg/s] at a time [s], or None to stay still
+        @param heading starting heading [deg]
+        @param cal_status calibration levels of the system, gyroscope, accelerometer and
+               magnetometer, each 0 to 3
+        @param latency_us virtual time charged for each bus transfer [us]
+        @param byte_us virtual time charged for each byte moved on the bus [us]
+        @param step_us longest time step used to integrate the heading [us]
+        '''
+        self.regs = bytearray(reg_count)
+        self.motion = motion
+        self.heading = heading % 360        # true heading, clockwise positive [deg]
+        self.yaw_rate = 0.0                 # true yaw rate, counterclockwise positive [deg/s]
+        self.latency_us = latency_us
+        self.byte_us = byte_us
+        self.step_us = step_us
+        self.time_us = 0                    # virtual clock [us]
+        self.set_cal_status(*cal_status)
+        self.reset_counts()
+        self._update_data()
+
+    def reset_counts(self):
+        '''!@brief Clears the bus transfer statistics.
+        '''
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0
+
+    def set_cal_status(self, sys, gyr, acc, mag):
+        '''!@brief Sets the calibration levels reported in the calibration status register.
+        '''
+        self.regs[cal_status_addr] = (sys << 6) | (gyr << 4) | (acc << 2) | mag
+
+    def mode(self):
+        '''!@brief Gets the name of the current operation mode.
+        '''
+        for name, number in imu_modes.items():
+            if number == self.regs[mode_addr]:
+                return name
+        return None
+
+    def ticks_us(self):
+        '''!@brief Gets the virtual time, for use in place of utime.ticks_us().
+        '''
+        return self.time_us
+
+    def advance(self, dt_us):
+        '''!@brief Moves the virtual clock forward and follows the motion profile.
+        @param dt_us time to move forward [us]
+        '''
+        while dt_us > 0:
+            step = min(dt_us, self.step_us)
+            if self.motion is not None:
+                self.yaw_rate = self.motion(self.time_us/1_000_000)
+            self.heading = (self.heading - self.yaw_rate*step/1_000_000) % 360
+            self.time_us += step
+            dt_us -= step
+        self._update_data()
+
+    def _update_data(self):
+        '''!@brief Writes the gyroscope and Euler angle data registers from the true motion.
+        @details Data registers are only updated outside configuration mode.
+        '''
+        if self.regs[mode_addr] == imu_modes['config']:
+            return
+        yaw_rate = max(-32768, min(32767, round(self.yaw_rate*16)))
+        heading = round(self.heading*16) % (360*16)
+        struct.pack_into('<hhh', self.regs, gyr_addr, 0, 0, yaw_rate)
+        struct.pack_into('<hhh', self.regs, euler_addr, heading, 0, 0)
+
+    def _transfer(self, addr, nbytes):
+        '''!@brief Checks the device address and charges a bus transfer to the virtual clock.
+        '''
+        if addr != dev_addr:
+            raise OSError(19)               # ENODEV, as when no device answers
+        self.transactions += 1
+        self.bytes += nbytes
+        cost = self.latency_us + self.byte_us*nbytes
+        self.bus_us += cost
+        if cost:
+            self.advance(cost)
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        '''!@brief Reads registers starting at memaddr into buf.
+        '''
+        self._transfer(addr, len(buf))
+        for idx in range(len(buf)):
+            buf[idx] = self.regs[memaddr + idx]
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        '''!@brief Reads nbytes registers starting at memaddr.
+        '''
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, memaddr, buf)
+        return bytes(buf)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        '''!@brief Writes buf into the registers starting at memaddr.
+        @details Writes to the offset registers are ignored outside configuration mode,
+                 and writes to read-only data registers are always ignored.
+        '''
+        self._transfer(addr, len(buf))
+        config = self.regs[mode_addr] == imu_modes['config']
+        for idx in range(len(buf)):
+            reg = memaddr + idx
+            if reg == mode_addr:
+                self.regs[reg] = buf[idx] & 0x0F
+                config = self.regs[reg] == imu_modes['config']
+            elif acc_offset_addr <= reg < acc_offset_addr + offset_len:
+                if config:
+                    self.regs[reg] = buf[idx]
+            elif reg < cal_status_addr + 1:
+                pass                         # data and status registers are read only
+            else:
+                self.regs[reg] = buf[idx]
+        self._update_data()
+
+if __name__ == '__main__':
+    from BNO055 import BNO055
+    from heading_estimator import heading_estimator, heading_error
+
+    # turn left, hold, turn right, over 6 s with 200 us per transfer plus 25 us per byte
+    motion = scripted_motion([(2, 45), (1, 0), (3, -30)])
+    chip = BNO055_emulator(motion, heading=10, latency_us=200, byte_us=25)
+    IMU = BNO055(chip)
+    IMU.set_opr_mode('ndof')
+
+    # offsets written in configuration mode must read back the same
+    IMU.apply_offsets(bytes(range(offset_len)))
+    print('offsets applied and confirmed')
+
+    # sample like the imu_sampling task: gyro every 5 ms, heading correction every 100 ms
+    estimator = heading_estimator()
+    worst = 0
+    for run in range(1200):
+        if run % 20 == 0:
+            IMU.read_gyr_euler()
+            estimator.propagate(IMU.gyr[2], chip.ticks_us())
+            estimator.correct(IMU.euler[0])
+        else:
+            IMU.read_gyr()
+            estimator.propagate(IMU.gyr[2], chip.ticks_us())
+        worst = max(worst, abs(heading_error(estimator.heading, chip.heading)))
+        chip.advance(5000 - (chip.time_us % 5000))
+
+    print(f"{chip.time_us/1_000_000:.2f} s simulated, {chip.transactions} transfers, "
+          f"{chip.bus_us/1000:.1f} ms on the bus")
+    print(f"true heading {chip.heading:.2f} deg, estimate {estimator.heading:.2f} deg, "
+          f"worst error {worst:.2f} deg")
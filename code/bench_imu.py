@@ -0,0 +1,73 @@
+"""!
+@file bench_imu.py
+@brief A host benchmark comparing separate and burst IMU reads.
+@details Runs the BNO055 driver against the BNO055 emulator, which counts bus transactions
+         and bytes instead of talking to a chip, so it can be run on a PC with MicroPython's
+         Unix port or CPython. Compares calling read_gyr() and read_euler() every pass
+         with a single read_gyr_euler() call. Memory allocated per pass is reported when
+         run under MicroPython, where gc.mem_alloc() is available.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import gc
+import time
+from BNO055 import BNO055
+from BNO055_emulator import BNO055_emulator
+
+def ticks_us():
+    '''!@brief Gets a microsecond timestamp on either MicroPython or CPython.
+    '''
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return time.perf_counter_ns() // 1000
+
+def mem_alloc():
+    '''!@brief Gets the number of heap bytes in use, or None if not known.
+    '''
+    try:
+        return gc.mem_alloc()
+    except AttributeError:
+        return None
+
+def run(name, imu, read, passes):
+    '''!@brief Runs one IMU read method many times and prints the bus and memory cost.
+    @param name label printed with the results
+    @param imu the BNO055 object whose bus is counted
+    @param read function performing one pass of reads
+    @param passes number of passes to run
+    '''
+    bus = imu.imu
+    read()                      # warm up so attributes already exist
+    bus.reset_counts()
+    gc.collect()
+    gc.disable()                # keep collections out of the allocation count
+    mem_start = mem_alloc()
+    time_start = ticks_us()
+    for _ in range(passes):
+        read()
+    duration = ticks_us() - time_start
+    mem_end = mem_alloc()
+    gc.enable()
+
+    line = (f"{name:<24s}{bus.transactions / passes: 8.1f} xfers/pass"
+            f"{bus.bytes / passes: 8.1f} bytes/pass{duration / passes: 10.2f} us/pass")
+    if mem_start is not None:
+        line += f"{(mem_end - mem_start) / passes: 10.1f} heap bytes/pass"
+    print(line)
+
+def separate_reads(imu):
+    '''!@brief Reads the gyroscope and Euler angles with two transactions.
+    '''
+    imu.read_gyr()
+    imu.read_euler()
+
+if __name__ == '__main__':
+    passes = 2000
+    imu = BNO055(BNO055_emulator(heading=100))
+    imu.set_opr_mode('ndof')
+    print(f"BNO055 gyro and heading read, {passes} passes")
+    run('read_gyr + read_euler', imu, lambda: separate_reads(imu), passes)
+    run('read_gyr_euler', imu, imu.read_gyr_euler, passes)
@@ -0,0 +1,60 @@
+"""!
+@file bench_queue.py
+@brief A benchmark comparing the throughput of task_share.Queue and task_share.SPSCQueue.
+@details Moves a fixed number of 16-bit items through each queue in chunks of the given
+         size, filling the queue with one chunk and then emptying it, as a task reading
+         samples buffered by an ISR would. The Queue is run both with and without thread
+         protection, since protection is needed when an ISR puts data into it. The
+         SPSCQueue is run an item at a time and in batches with put_many() and get_into().
+         Run it on the Nucleo.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import gc
+import utime
+from array import array
+import task_share
+
+items = 4000        # number of items moved through each queue
+chunk = 32          # number of items put in before they are read back out
+
+def one_at_a_time(queue, data, out):
+    '''!@brief Moves the items through a queue with put() and get().
+    '''
+    for start in range(0, items, chunk):
+        for idx in range(chunk):
+            queue.put(data[idx])
+        for idx in range(chunk):
+            out[idx] = queue.get()
+
+def spsc_batch(queue, data, out):
+    '''!@brief Moves the items through an SPSCQueue a chunk at a time.
+    '''
+    for start in range(0, items, chunk):
+        queue.put_many(data)
+        queue.get_into(out)
+
+def run(name, move, queue):
+    '''!@brief Times one way of moving the items and prints the throughput.
+    @param name label printed with the results
+    @param move function moving the items through the queue
+    @param queue the queue to use
+    '''
+    data = array('h', range(chunk))
+    out = array('h', range(chunk))
+    gc.collect()
+    time_start = utime.ticks_us()
+    move(queue, data, out)
+    duration = utime.ticks_diff(utime.ticks_us(), time_start)
+    if out != data:
+        print(f"{name}: items came out wrong")
+    print(f"{name:<32s}{duration / items: 8.2f} us/item{items * 1_000_000 // duration: 10d} items/s")
+
+if __name__ == '__main__':
+    print(f"{items} items in chunks of {chunk}")
+    run('Queue', one_at_a_time, task_share.Queue('h', chunk, thread_protect=False))
+    run('Queue, thread protected', one_at_a_time, task_share.Queue('h', chunk, thread_protect=True))
+    run('SPSCQueue put/get', one_at_a_time, task_share.SPSCQueue('h', chunk))
+    run('SPSCQueue put_many/get_into', spsc_batch, task_share.SPSCQueue('h', chunk))
@@ -0,0 +1,68 @@
+"""!
+@file bench_sched.py
+@brief A benchmark comparing the dispatch overhead of the cotask schedulers.
+@details Builds task lists of 5, 20 and 100 tasks whose generators do nothing but yield,
+         with periods and priorities like those used in main.py, and runs each list with
+         pri_sched(), rr_sched() and deadline_sched() for a fixed time. Since the tasks do
+         no work, the time spent in each scheduler call is almost all dispatch overhead.
+         The average and longest call are reported along with the task runs made and
+         the worst lateness. Run it on the Nucleo or with MicroPython's Unix port.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import gc
+import utime
+import cotask
+
+periods = (2, 2, 5, 25, 150)   # task periods used by main.py [ms]
+run_ms = 1000                  # time each scheduler is run for [ms]
+
+def idle_task():
+    '''!@brief A task which does nothing but yield.
+    '''
+    while True:
+        yield 0
+
+def make_list(n_tasks):
+    '''!@brief Creates a task list of idle tasks with main.py's periods and priorities.
+    @param n_tasks number of tasks in the list
+    '''
+    task_list = cotask.TaskList()
+    for idx in range(n_tasks):
+        task_list.append(cotask.Task(idle_task, name=f"T{idx}", priority=idx % 4 + 1,
+                                     period=periods[idx % len(periods)], profile=True))
+    return task_list
+
+def run(n_tasks, name):
+    '''!@brief Runs one scheduler on a new task list and prints its overhead.
+    @param n_tasks number of tasks in the list
+    @param name name of the TaskList scheduling method to run
+    '''
+    task_list = make_list(n_tasks)
+    sched = getattr(task_list, name)
+    gc.collect()
+    calls = 0
+    call_sum = 0
+    call_max = 0
+    time_start = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), time_start) < run_ms:
+        call_start = utime.ticks_us()
+        sched()
+        call_time = utime.ticks_diff(utime.ticks_us(), call_start)
+        call_sum += call_time
+        if call_time > call_max:
+            call_max = call_time
+        calls += 1
+
+    runs = sum(task._runs for pri in task_list.pri_list for task in pri[2:])
+    late = max(task._latest for pri in task_list.pri_list for task in pri[2:])
+    print(f"{n_tasks: 5d} {name:<16s}{call_sum / calls: 10.2f}{call_max: 10d}"
+          f"{runs: 8d}{late / 1000: 10.3f}")
+
+if __name__ == '__main__':
+    print('TASKS SCHEDULER     US/CALL  MAX CALL    RUNS  MAX LATE')
+    for n_tasks in (5, 20, 100):
+        for name in ('pri_sched', 'rr_sched', 'deadline_sched'):
+            run(n_tasks, name)
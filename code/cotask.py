@@ -28,8 +28,48 @@
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import gc                              # Memory allocation garbage collector
-import utime                           # Micropython version of time library
-import micropython                     # This shuts up incorrect warnings
+import array                           # Fixed-size buffers for tracing
+import struct                          # Packs binary trace headers
+try:
+    import utime                       # Micropython version of time library
+    import machine                     # Used to sleep the CPU while idle
+    import micropython                 # This shuts up incorrect warnings
+except ImportError:
+    # On a PC, stand-ins are used for the modules which are missing
+    from host_compat import utime, machine, micropython
+
+
+## The clock from which the scheduler gets all its times. It is the 
+#  @c utime module unless @c set_clock() has been called to use another
+#  clock, such as a @c VirtualClock on a PC. 
+clock = utime
+
+
+## The task whose generator is being run, or @c None between task runs. 
+#  Code called from a task, such as @c task_share.Queue.recv(), uses it to
+#  find the task to suspend, and @c task_share.Share.put() uses it so that 
+#  a task is not released by its own writes.
+current_task = None
+
+
+## The total time spent running timer released tasks from 
+#  @c micropython.schedule(), in microseconds, wrapping around as the times 
+#  of @c utime do. Such a run may come in the middle of another task or of 
+#  @c TaskList.idle(), which take the time it used out of their own.
+scheduled_us = 0
+
+
+## Change the clock used by the scheduler. This should be done before any 
+#  tasks or simulated timers are created, since they read the clock when 
+#  they are made.
+#  @param new_clock An object with @c ticks_us() and @c ticks_ms() methods
+#         whose times wrap around as those of @c utime do. If it also has
+#         a @c sleep_us() method, @c TaskList.idle() waits by calling it
+#         instead of sleeping the CPU, which lets a virtual clock jump 
+#         straight to the next task's release
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
 
 
 ## Implements multitasking with scheduling and some performance logging.
@@ -81,12 +121,29 @@ class Task:
     #         The time can be given in a @c float or @c int; it will be 
     #         converted to microseconds for internal use by the scheduler.
     #  @param profile Set to @c True to enable run-time profiling 
-    #  @param trace Set to @c True to generate a list of transitions between
-    #         states. @b Note: This slows things down and allocates memory.
+    #  @param trace Set to @c True to record transitions between states in a
+    #         fixed-size buffer. The buffer is allocated when the task is 
+    #         created, so tracing allocates no memory while the task runs.
     #  @param shares A list or tuple of shares and queues used by this task.
     #         If no list is given, no shares are passed to the task
+    #  @param trace_size The number of most recent transitions kept when 
+    #         tracing. States must be integers from -32768 to 32767
+    #  @param hist_bins The number of bins in each profiling histogram of run
+    #         durations and release lateness. Times longer than the last bin
+    #         are counted in the last bin
+    #  @param hist_us The width of each histogram bin in microseconds
+    #  @param overrun What a timed task does when it is found due a whole 
+    #         period or more late, so that one or more later releases are 
+    #         also due: @c 'catch_up' runs once for each missed release, 
+    #         back to back; @c 'skip' drops the missed releases and waits for
+    #         the next one on its original schedule; @c 'realign' restarts 
+    #         the schedule one period from now
+    #  @param catch_up_limit In @c 'catch_up' mode, the largest number of 
+    #         missed releases which are made up, or @c None for no limit
     def __init__(self, run_fun, name="NoName", priority=0, period=None,
-                 profile=False, trace=False, shares=()):
+                 profile=False, trace=False, shares=(), trace_size=100,
+                 hist_bins=32, hist_us=100, overrun='catch_up', 
+                 catch_up_limit=None):
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
         # gets it going as a generator which is ready to yield values
@@ -109,30 +166,51 @@ class Task:
         #  @c go() method. 
         if period != None:
             self.period = int(period * 1000)
-            self._next_run = utime.ticks_us() + self.period
+            self._next_run = utime.ticks_diff(self.period, -clock.ticks_us())
         else:
             self.period = period
             self._next_run = None
 
+        # What to do about releases missed by running late
+        if overrun not in ('catch_up', 'skip', 'realign'):
+            raise ValueError('Unknown overrun policy: ' + str(overrun))
+        self._overrun = overrun
+        self._catch_up_limit = catch_up_limit
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
+        # Histograms of run durations and lateness are only allocated if so
         self._prof = profile
+        bins = hist_bins if profile else 0
+        self._hist_us = int(hist_us)
+        self._run_hist = array.array('I', [0] * bins)
+        self._late_hist = array.array('I', [0] * bins)
         self.reset_profile()
 
         # The previous state in which the task last ran. It is used to watch
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
+        # If transition tracing has been enabled, create a ring buffer in 
+        # which to store transition times and to-states. The times are the
+        # microseconds since the previous transition
         self._trace = trace
-        self._tr_data = []
-        self._prev_time = utime.ticks_us()
+        size = trace_size if trace else 0
+        self._tr_time = array.array('I', [0] * size)
+        self._tr_state = array.array('h', [0] * size)
+        self._tr_idx = 0               # Index where the next transition goes
+        self._tr_count = 0             # Number of transitions ever recorded
+        self._prev_time = clock.ticks_us()
 
         ## Flag which is set true when the task is ready to be run by the
         #  scheduler
         self.go_flag = False
 
+        # Whether the task is blocked by block(), and the time at which it
+        # stops waiting if it was given a timeout
+        self._blocked = False
+        self._wake_time = None
+
 
     ## This method is called by the scheduler; it attempts to run this task.
     #  If the task is not yet ready to run, this method returns @c False
@@ -142,52 +220,66 @@ class Task:
     #  @return @c True if the task ran or @c False if it did not
     def schedule(self) -> bool:
         if self.ready():
-
-            # Reset the go flag for the next run
-            self.go_flag = False
-
-            # If profiling, save the start time
-            if self._prof:
-                stime = utime.ticks_us()
-
-            # Run the method belonging to the state which should be run next
-            curr_state = next(self._run_gen)
-
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
-                etime = utime.ticks_us()
-
-            # If profiling, save timing data
-            if self._prof:
-                self._runs += 1
-                runt = utime.ticks_diff(etime, stime)
-                if self._runs > 2:
-                    self._run_sum += runt
-                    if runt > self._slowest:
-                        self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append(
-                            (utime.ticks_diff(etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect()
-
-                self._prev_state = curr_state
-                self._prev_time = etime
-
+            self.run()
             return True
 
         else:
             return False
 
 
+    ## This method runs the task's generator up to its next @c yield(), 
+    #  keeping the profiling and tracing data. It is called by a scheduler
+    #  once the task has been found ready to run. 
+    def run(self):
+        # Reset the go flag for the next run and note which task is running,
+        # keeping the group which is running this task as a member
+        global current_task
+        self.go_flag = False
+        outer_task = current_task
+        current_task = self
+
+        # If profiling, save the start time
+        if self._prof:
+            stime = clock.ticks_us()
+            stolen = scheduled_us
+
+        # Run the method belonging to the state which should be run next
+        curr_state = next(self._run_gen)
+        current_task = outer_task
+
+        # If profiling or tracing, save timing data
+        if self._prof or self._trace:
+            etime = clock.ticks_us()
+
+        # If profiling, save timing data
+        if self._prof:
+            self._runs += 1
+            runt = utime.ticks_diff(etime, stime) \
+                - utime.ticks_diff(scheduled_us, stolen)
+            if self._runs > 2:
+                self._run_sum += runt
+                if runt > self._slowest:
+                    self._slowest = runt
+                self._count(self._run_hist, runt)
+
+        # If transition logic tracing is on, record a transition in the ring
+        # buffer, overwriting the oldest one if it's full; if not, ignore the
+        # state
+        if self._trace:
+            if curr_state != self._prev_state:
+                idx = self._tr_idx
+                self._tr_time[idx] = utime.ticks_diff(etime, self._prev_time)
+                self._tr_state[idx] = curr_state
+                idx += 1
+                if idx >= len(self._tr_time):
+                    idx = 0
+                self._tr_idx = idx
+                self._tr_count += 1
+                self._prev_time = etime
+
+            self._prev_state = curr_state
+
+
     ## This method checks if the task is ready to run.
     #  If the task runs on a timer, this method checks what time it is; if not,
     #  this method checks the flag which indicates that the task is ready to
@@ -195,49 +287,216 @@ class Task:
     #  some other behavior.
     @micropython.native
     def ready(self) -> bool:
+        # A blocked task is run when its go flag is set or its timeout passes,
+        # and not on its period
+        if self._blocked:
+            if self._wake_time is not None and \
+                    utime.ticks_diff(clock.ticks_us(), self._wake_time) >= 0:
+                return True
+            return self.go_flag
+
         # If this task uses a timer, check if it's time to run run() again. If
         # so, set go flag and set the timer to go off at the next run time
         if self.period != None:
-            late = utime.ticks_diff(utime.ticks_us(), self._next_run)
-            if late > 0:
-                self.go_flag = True
-                self._next_run = utime.ticks_diff(self.period, 
-                                                  -self._next_run)
-
-                # If keeping a latency profile, record the data
-                if self._prof:
-                    self._late_sum += late
-                    if late > self._latest:
-                        self._latest = late
+            late = utime.ticks_diff(clock.ticks_us(), self._next_run)
+            if late >= 0:
+                self.release(late)
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
 
 
+    ## This method releases a timed task which has become due, setting its
+    #  go flag and the time of its next run. It is called by @c ready() and by
+    #  schedulers which have already read the clock. If the task is a whole 
+    #  period or more late, its deadline has been missed; the missed releases
+    #  are counted and the next run time is set by the overrun policy.
+    #  @param late How long after its release time the task was found due, 
+    #         in microseconds
+    @micropython.native
+    def release(self, late):
+        self.go_flag = True
+        if late < self.period:
+            self._next_run = utime.ticks_diff(self.period, -self._next_run)
+        else:
+            # This many more releases are due; the run about to be made 
+            # serves the latest of them if skipping or realigning, so the 
+            # others are missed. Catching up, this release is missed along
+            # with any which are dropped for being beyond the limit
+            missed = late // self.period
+            if self._overrun == 'realign':
+                self._missed += missed
+                self._next_run = utime.ticks_diff(self.period + late,
+                                                  -self._next_run)
+            else:
+                if self._overrun == 'skip':
+                    steps = missed + 1
+                    self._missed += missed
+                else:
+                    steps = 1
+                    if (self._catch_up_limit is not None 
+                            and missed > self._catch_up_limit):
+                        steps += missed - self._catch_up_limit
+                    self._missed += steps
+                self._next_run = utime.ticks_diff(steps * self.period,
+                                                  -self._next_run)
+
+        # If keeping a latency profile, record the data
+        if self._prof:
+            self._late_sum += late
+            if late > self._latest:
+                self._latest = late
+            self._count(self._late_hist, late)
+
+
+    ## Count a time in the histogram bin which holds it. Times beyond the 
+    #  last bin are counted in the last bin.
+    #  @param hist The histogram, either @c _run_hist or @c _late_hist
+    #  @param time The time to be counted in microseconds
+    @micropython.native
+    def _count(self, hist, time):
+        idx = time // self._hist_us
+        if idx >= len(hist):
+            idx = len(hist) - 1
+        elif idx < 0:
+            idx = 0
+        hist[idx] += 1
+
+
+    ## Suspend the task until @c go() is called or a timeout passes.
+    #
+    #  This is called by the task's own code just before it yields, by code
+    #  such as @c task_share.Queue.recv() which waits for something. While 
+    #  it waits, the task is not run on its period; @c ready() and 
+    #  @c TaskList.time_to_next() check only its go flag and the wake-up 
+    #  time at the end of the timeout, which is kept apart from the task's 
+    #  period and next run time, so the release statistics only ever 
+    #  describe the task's own schedule. @c unblock() must be called when 
+    #  the task is done waiting. A timed task must not block while 
+    #  scheduled by @c deadline_sched() or @c cyclic_sched(), which release
+    #  it on its period regardless.
+    #  @param timeout_us The longest time to wait in microseconds, or 
+    #         @c None to wait until @c go() is called
+    def block(self, timeout_us=None):
+        self._blocked = True
+        if timeout_us is None:
+            self._wake_time = None
+        else:
+            self._wake_time = utime.ticks_diff(timeout_us, -clock.ticks_us())
+
+
+    ## Stop waiting after @c block(). The releases of a timed task which 
+    #  came while it waited are dropped without being counted as missed, 
+    #  and it next runs at the first release time still to come on its 
+    #  original schedule.
+    def unblock(self):
+        self._blocked = False
+        self._wake_time = None
+        if self.period != None:
+            late = utime.ticks_diff(clock.ticks_us(), self._next_run)
+            if late >= 0:
+                self._next_run = utime.ticks_diff(
+                    (late // self.period + 1) * self.period, -self._next_run)
+
+
+    ## Check whether the timeout given to @c block() has passed.
+    #  @return @c True if the task blocked with a timeout which has passed
+    def timed_out(self) -> bool:
+        return (self._wake_time is not None and 
+                utime.ticks_diff(clock.ticks_us(), self._wake_time) >= 0)
+
+
     ## This method sets the period between runs of the task to the given
     #  number of milliseconds, or @c None if the task is triggered by calls
-    #  to @c go() rather than time.
+    #  to @c go() rather than time. A task can use this to sleep while it has
+    #  nothing to do, waking only when @c go() is called, for example by a
+    #  share it has subscribed to, and to go back to running on time when it 
+    #  has work. A task which had no period is first due one period from 
+    #  now. The deadline scheduler's heap must be rebuilt, by appending a 
+    #  task, if a task changes between having a period and having none.
     #  @param new_period The new period in milliseconds between task runs
     def set_period(self, new_period):
         if new_period is None:
             self.period = None
         else:
-            self.period = int(new_period) * 1000
+            was_timed = self.period is not None
+            self.period = int(new_period * 1000)
+            if not was_timed:
+                self._next_run = utime.ticks_diff(self.period, 
+                                                  -clock.ticks_us())
 
 
     ## This method resets the variables used for execution time profiling.
     #  This method is also used by @c __init__() to create the variables.
     def reset_profile(self):
         self._runs = 0
+        self._missed = 0
         self._run_sum = 0
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        for idx in range(len(self._run_hist)):
+            self._run_hist[idx] = 0
+            self._late_hist[idx] = 0
+
+
+    ## Find a percentile of the times counted in a profiling histogram.
+    #  The result is the upper edge of the bin holding the percentile, so it
+    #  is never less than the true value and is at most one bin width above
+    #  it. If the percentile falls in the last bin, which also holds all 
+    #  longer times, the largest time seen is returned instead. 
+    #  @param hist The histogram, either @c _run_hist or @c _late_hist
+    #  @param percent The percentile wanted, from 0 to 100
+    #  @param largest The largest time which has been counted
+    #  @return The percentile in microseconds, or @c None if nothing has 
+    #          been counted
+    def _percentile(self, hist, percent, largest):
+        total = sum(hist)
+        if total == 0:
+            return None
+        wanted = total * percent / 100
+        count = 0
+        for idx in range(len(hist) - 1):
+            count += hist[idx]
+            if count >= wanted:
+                return min((idx + 1) * self._hist_us, largest)
+        return largest
+
+
+    ## Make a string showing the 50th, 95th and 99th percentiles of the run
+    #  duration and, for timed tasks, the release lateness of this task. 
+    #  The times are in milliseconds, as in the task list table.
+    #  @return The string showing the percentiles
+    def get_percentiles(self):
+        rst = f"{self.name:<16s}"
+        if not self._prof or self._runs == 0:
+            return rst + '  not profiled'
+        for hist, largest in ((self._run_hist, self._slowest),
+                              (self._late_hist, self._latest)):
+            for percent in (50, 95, 99):
+                time = self._percentile(hist, percent, largest)
+                if time is None:
+                    rst += '         -'
+                else:
+                    rst += f"{(time / 1000.0): 10.3f}"
+        return rst
+
+
+    ## Get the number of releases this task has missed since the profile was
+    #  last reset. For a timed task, these are the releases which were 
+    #  already due when the task was released a whole period or more late; 
+    #  for a timer released task, they are the timer interrupts which came
+    #  before the previous release had been run.
+    #  @return The number of missed releases
+    def get_missed(self):
+        return self._missed
 
 
     ## This method returns a string containing the task's transition trace.
     #  The trace is a set of tuples, each of which contains a time and the
-    #  states from and to which the system transitioned. 
+    #  states from and to which the system transitioned. Times are measured
+    #  from the task's creation, or from the oldest transition still held if 
+    #  the trace buffer has filled and older transitions were overwritten.
     #  @return A possibly quite large string showing state transitions
     def get_trace(self):
         tr_str = 'Task ' + self.name + ':'
@@ -245,19 +504,68 @@ class Task:
             tr_str += '\n'
             last_state = 0
             total_time = 0.0
-            for item in self._tr_data:
-                total_time += item[0] / 1000000.0
+            for idx in self._trace_order():
+                total_time += self._tr_time[idx] / 1000000.0
                 tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
-                    last_state, item[1])
-                last_state = item[1]
+                    last_state, self._tr_state[idx])
+                last_state = self._tr_state[idx]
+            if self._tr_count > len(self._tr_time):
+                tr_str += '({:d} older transitions overwritten)\n'.format (
+                    self._tr_count - len(self._tr_time))
         else:
             tr_str += ' not traced'
         return tr_str
 
 
+    ## Get the indices of the transitions held in the trace buffer, from the
+    #  oldest to the newest.
+    #  @return A range, or a pair of ranges if the buffer has wrapped around
+    def _trace_order(self):
+        if self._tr_count <= len(self._tr_time):
+            return range(self._tr_count)
+        return (idx % len(self._tr_time) for idx in 
+                range(self._tr_idx, self._tr_idx + len(self._tr_time)))
+
+
+    ## Write the task's transition trace to a stream in binary form.
+    #
+    #  The stream can be a @c UART or a file; anything with a @c write() 
+    #  method which accepts bytes. All values are little-endian:
+    #  | Field | Type |
+    #  |:------|:-----|
+    #  | Magic bytes @c b'CTRC' | 4 bytes |
+    #  | Length of the task name | uint8 |
+    #  | Task name | ASCII bytes |
+    #  | Number of transitions held, @c N | uint16 |
+    #  | Number of transitions ever recorded | uint32 |
+    #  | Time since the previous transition for each of @c N, oldest first | uint32 [us] |
+    #  | State entered for each of @c N, oldest first | int16 |
+    #
+    #  Only the header is packed; the trace itself is written straight from 
+    #  the trace buffers. 
+    #  @param stream The stream to which the trace is written
+    def dump_trace(self, stream):
+        name = self.name.encode ()
+        held = min(self._tr_count, len(self._tr_time)) if self._trace else 0
+        stream.write(struct.pack('<4sB', b'CTRC', len(name)))
+        stream.write(name)
+        stream.write(struct.pack('<HL', held, self._tr_count))
+        if held:
+            # Write each buffer oldest first, in two pieces if it has wrapped
+            split = self._tr_idx if self._tr_count > held else 0
+            for buf in (self._tr_time, self._tr_state):
+                view = memoryview(buf)
+                stream.write(view[split:held])
+                if split:
+                    stream.write(view[:split])
+
+
     ## Method to set a flag so that this task indicates that it's ready to run.
     #  This method may be called from an interrupt service routine or from
     #  another task which has data that this task needs to process soon.
+    #  A share calls it for each task which has subscribed to the share when
+    #  the share's value changes; see @c task_share.Share.subscribe(). A task
+    #  with no period is run only after this method has been called.
     def go(self):
         self.go_flag = True
 
@@ -272,7 +580,7 @@ class Task:
             rst += f"{(self.period / 1000.0): 10.1f}"
         except TypeError:
             rst += '         -'
-        rst += f"{self._runs: 8d}"
+        rst += f"{self._runs: 8d}{self._missed: 8d}"
 
         if self._prof and self._runs > 0:
             avg_dur = (self._run_sum / self._runs) / 1000.0
@@ -285,6 +593,356 @@ class Task:
 
 # =============================================================================
 
+## A task which is released by a hardware timer interrupt.
+#
+#  The release of a timed @c Task happens only when the scheduler gets 
+#  around to checking the clock, so its actual rate depends on how long the
+#  other tasks run. A @c TimerTask is instead released by the callback of a
+#  timer such as a @c pyb.Timer, which records the release time; the task's
+#  period is taken from the timer's frequency. The release latency, which 
+#  is the time from the timer interrupt to the start of the run, is kept 
+#  along with its smallest and largest values and the number of releases
+#  which came before the previous one had run.
+#
+#  In the default @c 'flag' mode the interrupt sets the go flag and the task
+#  is run by the scheduler like a task triggered by @c go(). It then waits
+#  for the task which is running to yield, so its release jitter is as large
+#  as the longest run of any other task. In @c 'schedule' mode the interrupt
+#  uses @c micropython.schedule() to run the task as soon as the interpreter
+#  reaches a safe point, even in the middle of another task, which bounds
+#  the jitter by the longest single operation which doesn't return to the
+#  interpreter, such as an I2C transfer or a garbage collection. The task 
+#  must then share nothing with other tasks which could be seen half 
+#  changed, and must not wait on other tasks; the time it takes is taken 
+#  out of the run time of the task it interrupted and out of the idle time.
+#
+#  The overrun policies of a timed @c Task don't apply, since the timer 
+#  keeps the schedule: a release which comes before the previous one has 
+#  run is counted as an overrun and merged with it, much as the @c 'skip'
+#  policy does, so no @c overrun argument is taken.
+#
+#  @b Example:
+#    @code
+#       task3 = cotask.TimerTask (motor_fun, pyb.Timer (6, freq=500),
+#                                 name = 'Motor', priority = 1, profile = True)
+#       cotask.task_list.append (task3)
+#    @endcode
+class TimerTask(Task):
+
+    ## Initialize a timer released task and attach it to the timer.
+    #  @param run_fun The generator function which implements the task's code
+    #  @param timer A timer with @c freq() and @c callback() methods, such as
+    #         a @c pyb.Timer or a @c SimTimer, which releases the task
+    #  @param name The name of the task
+    #  @param priority The priority of the task, used in @c 'flag' mode
+    #  @param profile Set to @c True to enable run-time profiling
+    #  @param trace Set to @c True to generate a list of state transitions
+    #  @param shares A list or tuple of shares and queues used by this task
+    #  @param mode @c 'flag' to have the scheduler run the task after the 
+    #         timer releases it, or @c 'schedule' to run it from 
+    #         @c micropython.schedule()
+    #  @param trace_size The number of most recent transitions kept when 
+    #         tracing
+    #  @param hist_bins The number of bins in each profiling histogram
+    #  @param hist_us The width of each histogram bin in microseconds
+    def __init__(self, run_fun, timer, name="NoName", priority=0,
+                 profile=False, trace=False, shares=(), mode='flag',
+                 trace_size=100, hist_bins=32, hist_us=100):
+        super().__init__(run_fun, name, priority, None, profile, trace, shares,
+                         trace_size, hist_bins, hist_us, overrun='skip')
+
+        ## The timer which releases this task
+        self.timer = timer
+        self.period = int(1000000 // timer.freq())
+        self._release_time = clock.ticks_us()
+        self._next_run = utime.ticks_diff(self.period, -self._release_time)
+        self._scheduled = mode == 'schedule'
+
+        # Bound methods are made now, since an interrupt may not allocate 
+        # the memory to make them
+        self._run_ref = self._scheduled_run
+        timer.callback(self._isr)
+
+
+    ## The timer interrupt callback which releases the task. It must not 
+    #  allocate memory. A release which comes while the previous one is 
+    #  still waiting is only counted, so that a run is never scheduled twice
+    #  and the small queue of @c micropython.schedule() can't be filled.
+    #  @param timer The timer which caused the interrupt (not used)
+    def _isr(self, timer):
+        self._release_time = clock.ticks_us()
+        self._next_run = utime.ticks_diff(self.period, -self._release_time)
+        if self.go_flag:
+            self._missed += 1
+        else:
+            self.go_flag = True
+            if self._scheduled:
+                micropython.schedule(self._run_ref, 0)
+
+
+    ## Run the task from @c micropython.schedule() in @c 'schedule' mode,
+    #  adding the time it takes to @c scheduled_us.
+    #  @param arg The argument given to @c micropython.schedule() (not used)
+    def _scheduled_run(self, arg):
+        global scheduled_us
+        if self.go_flag:
+            start = clock.ticks_us()
+            self.run()
+            scheduled_us = (scheduled_us 
+                + utime.ticks_diff(clock.ticks_us(), start)) & 0x3FFFFFFF
+
+
+    ## Check whether the timer has released the task. In @c 'schedule' mode
+    #  the task is never run by the scheduler.
+    #  @return @c True if the task should be run now
+    def ready(self) -> bool:
+        return self.go_flag and not self._scheduled
+
+
+    ## Suspend the task until @c go() is called or a timeout passes. The 
+    #  timer keeps releasing the task while it waits, so only the timeout is
+    #  recorded and the task's period is left alone.
+    #  @param timeout_us The longest time to wait in microseconds, or 
+    #         @c None to wait until @c go() is called
+    def block(self, timeout_us=None):
+        if timeout_us is None:
+            self._wake_time = None
+        else:
+            self._wake_time = utime.ticks_diff(timeout_us, -clock.ticks_us())
+
+
+    ## Stop waiting after @c block().
+    def unblock(self):
+        self._wake_time = None
+
+
+    ## Run the task up to its next @c yield(), recording its release latency.
+    def run(self):
+        if self._prof:
+            late = utime.ticks_diff(clock.ticks_us(), self._release_time)
+            self._late_sum += late
+            if late > self._latest:
+                self._latest = late
+            if late < self._earliest:
+                self._earliest = late
+            self._count(self._late_hist, late)
+        super().run()
+
+
+    ## Reset the profiling data including the release latency statistics.
+    def reset_profile(self):
+        super().reset_profile()
+        self._earliest = 0x3FFFFFFF
+
+
+    ## Make a string showing the release latency statistics of this task.
+    #  The jitter is the difference between the largest and smallest 
+    #  release latencies.
+    #  @return The string showing the release latency statistics
+    def get_release_stats(self):
+        if not self._prof or self._runs == 0:
+            return self.name + ': not profiled'
+        return (f"{self.name}: latency avg {self._late_sum / self._runs:.0f} us"
+                f" min {self._earliest} us max {self._latest} us"
+                f" jitter {self._latest - self._earliest} us"
+                f" overruns {self._missed}")
+
+
+# =============================================================================
+
+## The generator run by a task group, which runs each of its member tasks 
+#  once, in order, every time the group runs. 
+#  @param members The tuple of member tasks
+def _run_members(members):
+    while True:
+        for task in members:
+            task.run()
+        yield 0
+
+
+## A group of tasks which run one after another as a single task.
+#
+#  Tasks which run at the same rate each pay for their own release check and
+#  scheduler pass. A group holds several such member tasks under one entry in
+#  the task list: when the group is released it runs every member's 
+#  generator once, back to back, in the order given. Member tasks are made 
+#  as usual but with no period and are not appended to the task list 
+#  themselves; each member keeps its own run time profile and trace, while
+#  the group's profile covers the whole group including its release 
+#  lateness. The task list table shows the members under their group.
+#
+#  @b Example:
+#    @code
+#       left = cotask.Task (motor_fun, name = 'Left', profile = True,
+#                           shares = (left_share,))
+#       right = cotask.Task (motor_fun, name = 'Right', profile = True,
+#                            shares = (right_share,))
+#       motors = cotask.TaskGroup ((left, right), name = 'Motors', 
+#                                  priority = 1, period = 2, profile = True)
+#       cotask.task_list.append (motors)
+#    @endcode
+class TaskGroup(Task):
+
+    ## Initialize a task group. The keyword arguments are those of @c Task,
+    #  except that the group has no shares of its own.
+    #  @param members A list or tuple of the tasks to be run by the group
+    def __init__(self, members, name="NoName", priority=0, period=None, 
+                 **kwargs):
+        ## The tuple of tasks run by this group, in the order they are run
+        self.members = tuple(members)
+        super().__init__(_run_members, name, priority, period, 
+                         shares=self.members, **kwargs)
+
+
+## A task group which is released by a hardware timer interrupt, as a 
+#  @c TimerTask is. 
+class TimerTaskGroup(TimerTask):
+
+    ## Initialize a timer released task group. The keyword arguments are 
+    #  those of @c TimerTask, except that the group has no shares of its own.
+    #  @param members A list or tuple of the tasks to be run by the group
+    #  @param timer The timer which releases the group
+    def __init__(self, members, timer, name="NoName", priority=0, **kwargs):
+        ## The tuple of tasks run by this group, in the order they are run
+        self.members = tuple(members)
+        super().__init__(_run_members, timer, name, priority, 
+                         shares=self.members, **kwargs)
+
+
+# =============================================================================
+
+## A stand-in for a @c pyb.Timer used to test timer released tasks on a PC.
+#
+#  A simulated timer has the @c freq() and @c callback() methods which 
+#  @c TimerTask uses. It does not interrupt anything; instead 
+#  @c poll_sim_timers() calls the callback of every simulated timer once for
+#  each of its periods which has passed on the clock. 
+class SimTimer:
+
+    ## Create a simulated timer and add it to the list polled by 
+    #  @c poll_sim_timers().
+    #  @param freq The frequency of the timer in Hz
+    def __init__(self, freq):
+        self._freq = freq
+        self._period = int(1000000 // freq)
+        self._next = utime.ticks_diff(self._period, -clock.ticks_us())
+        self._callback = None
+        sim_timers.append(self)
+
+
+    ## Get the frequency of the timer.
+    #  @return The frequency in Hz
+    def freq(self):
+        return self._freq
+
+
+    ## Set the function called each time the timer period passes.
+    #  @param fun The callback function, which is given this timer
+    def callback(self, fun):
+        self._callback = fun
+
+
+    ## Call the callback once for each timer period which has passed.
+    def poll(self):
+        while utime.ticks_diff(clock.ticks_us(), self._next) >= 0:
+            self._next = utime.ticks_diff(self._period, -self._next)
+            if self._callback:
+                self._callback(self)
+
+
+## The list of simulated timers which are polled by @c poll_sim_timers().
+sim_timers = []
+
+
+## Fire the callbacks of all simulated timers whose periods have passed. A
+#  host test calls this each time through its scheduling loop.
+def poll_sim_timers():
+    for timer in sim_timers:
+        timer.poll()
+
+
+# =============================================================================
+
+## A clock which only moves when it is told to, for running a task set on a
+#  PC faster than real time and exactly the same way every time.
+#
+#  After @c set_clock() is given a virtual clock, every time the scheduler 
+#  reads comes from it. Time stands still while tasks run, so each run takes
+#  no time unless a task or the test moves the clock forward; when nothing
+#  is ready, @c TaskList.idle() moves the clock straight to the next 
+#  release. Simulated timers are fired at exactly their due times as the
+#  clock passes them, so timer released tasks run in lockstep with timed
+#  ones. The times wrap around as those of @c utime do.
+#
+#  @b Example:
+#    @code
+#       sim_clock = cotask.VirtualClock ()
+#       cotask.set_clock (sim_clock)
+#       # ...create and append tasks...
+#       while sim_clock.ticks_ms () < 10000:
+#           if not cotask.task_list.pri_sched ():
+#               cotask.task_list.idle ()
+#    @endcode
+class VirtualClock:
+
+    ## Create a virtual clock.
+    #  @param start_us The time at which the clock starts in microseconds
+    def __init__(self, start_us=0):
+        self._now = start_us
+
+
+    ## Get the virtual time in microseconds.
+    def ticks_us(self):
+        return self._now & 0x3FFFFFFF
+
+
+    ## Get the virtual time in milliseconds.
+    def ticks_ms(self):
+        return (self._now // 1000) & 0x3FFFFFFF
+
+
+    ## Move the clock forward, stopping at the due time of each simulated 
+    #  timer on the way to fire its callback. A task run from a callback in
+    #  @c 'schedule' mode moves the clock forward itself; the end is then 
+    #  put off by the time it took, as a task it interrupts on the robot 
+    #  still has all of its own work to do.
+    #  @param time_us The time to move forward in microseconds
+    #  @param stretch @c False to end at the given time even if callbacks 
+    #         used some of it, as a sleep ended by an interrupt does
+    def advance(self, time_us, stretch=True):
+        end = self._now + time_us
+        while self._now < end:
+            # Find the simulated timer which is due soonest
+            step = end - self._now
+            for timer in sim_timers:
+                due = utime.ticks_diff(timer._next, self.ticks_us())
+                if due < step:
+                    step = due if due > 0 else 0
+            self._now += step
+            if self._now >= end:
+                break
+            polled = self._now
+            poll_sim_timers()
+            if stretch:
+                end += self._now - polled
+        poll_sim_timers()
+
+
+    ## Wait by moving the clock forward; used by @c TaskList.idle().
+    #  @param time_us The time to wait in microseconds
+    def sleep_us(self, time_us):
+        self.advance(time_us, False)
+
+
+# =============================================================================
+
+## Find the greatest common divisor of two positive integers.
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
 ## A list of tasks used internally by the task scheduler.
 #  This class holds the list of tasks which will be run by the task scheduler.
 #  The task list is usually not directly used by the programmer except when
@@ -308,6 +966,30 @@ class TaskList:
         #  that priority. 
         self.pri_list = []
 
+        # The heap of timed tasks ordered by next run time and the list of
+        # tasks run by go(), both used by the deadline scheduler. They are 
+        # built when the deadline scheduler is first called after a task has
+        # been appended
+        self._heap = None
+        self._event_tasks = []
+
+        ## The shortest wait, in microseconds, for which @c idle() puts the 
+        #  CPU to sleep. The CPU is woken by the next interrupt, and the 1 ms
+        #  system tick interrupt is always running, so shorter waits are 
+        #  spent polling rather than risking oversleeping a task's release.
+        #  This is set by the tick rather than by the cost of waking up, 
+        #  which is only a few microseconds, so lowering it trades release
+        #  lateness of up to 1 ms for sleep. If a task runs every 1 ms or 
+        #  faster, waits are never this long and @c idle() never sleeps; the
+        #  time asleep is shown with the utilization so this can be checked.
+        self.min_sleep_us = 1100
+
+        # The dispatch table used by the cyclic executive, which is built by
+        # build_cyclic(). It is None until then
+        self._cyc_start = None
+
+        self.reset_utilization()
+
 
     ## Append a task to the task list. The list will be sorted by task 
     #  priorities so that the scheduler can quickly find the highest priority
@@ -333,6 +1015,9 @@ class TaskList:
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort(key=lambda pri: pri[0], reverse=True)
 
+        # The deadline heap has to be rebuilt to include the new task
+        self._heap = None
+
 
     ## Run tasks in order, ignoring the tasks' priorities.
     #
@@ -343,12 +1028,16 @@ class TaskList:
     #  tasks are given a chance to run each time through the list, and it takes
     #  about the same amount of time before each is given a chance to run 
     #  again.
+    #  @return @c True if any task was run, @c False if none was ready
     @micropython.native
     def rr_sched(self):
         # For each priority level, run all tasks at that level
+        ran = False
         for pri in self.pri_list:
             for task in pri[2:]:
-                task.schedule()
+                if task.schedule():
+                    ran = True
+        return ran
 
 
     ## Run tasks according to their priorities.
@@ -356,6 +1045,7 @@ class TaskList:
     #  This scheduler runs tasks in a priority based fashion. Each time it is
     #  called, it finds the highest priority task which is ready to run and
     #  calls that task's @c run() method.
+    #  @return @c True if a task was run, @c False if none was ready
     @micropython.native
     def pri_sched(self):
         # Go down the list of priorities, beginning with the highest
@@ -372,16 +1062,415 @@ class TaskList:
                 if pri[1] >= length:
                     pri[1] = 2
                 if ran:
-                    return
+                    return True
 
+        return False
 
-    ## Create some diagnostic text showing the tasks in the task list.
-    def __repr__(self):
-        ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+
+    ## Run the task whose next run time is earliest, if it is due.
+    #
+    #  This scheduler keeps the timed tasks in a binary heap ordered by the 
+    #  time each task is next due to run, so the task at the top of the heap
+    #  is the only one which needs to be checked. The clock is read once per 
+    #  call, and finding and rescheduling the task takes O(log n) time 
+    #  rather than a scan of every task. Task priorities are ignored for 
+    #  timed tasks; the earliest release runs first. If no timed task is due,
+    #  tasks with no period and timer released tasks are run if their go 
+    #  flags have been set. 
+    #  Tasks must not change between having a period and having none while 
+    #  this scheduler is in use.
+    #  @return @c True if a task was run, @c False if none was ready
+    @micropython.native
+    def deadline_sched(self):
+        if self._heap is None:
+            self._build_heap()
+
+        # Only the task at the top of the heap can be the next one due
+        heap = self._heap
+        if heap:
+            task = heap[0]
+            late = utime.ticks_diff(clock.ticks_us(), task._next_run)
+            if late >= 0:
+                task.release(late)
+                self._sift_down(0)       # its next run time is now later
+                task.run()
+                return True
+
+        for task in self._event_tasks:
+            if task.ready():
+                task.run()
+                return True
+
+        return False
+
+
+    ## Build the heap of timed tasks and the list of tasks run by @c go()
+    #  which are used by the deadline scheduler.
+    def _build_heap(self):
+        self._heap = []
+        self._event_tasks = []
         for pri in self.pri_list:
             for task in pri[2:]:
-                ret_str += str(task) + '\n'
+                if task.period is None or isinstance(task, TimerTask):
+                    self._event_tasks.append(task)
+                else:
+                    self._heap.append(task)
+
+        for idx in range(len(self._heap) // 2 - 1, -1, -1):
+            self._sift_down(idx)
+
+
+    ## Move a task down the deadline heap until no task below it is due 
+    #  sooner. Times are compared with @c ticks_diff() so that the order is
+    #  kept when the microsecond timer wraps around.
+    #  @param idx The index in the heap of the task to be moved
+    @micropython.native
+    def _sift_down(self, idx):
+        heap = self._heap
+        length = len(heap)
+        task = heap[idx]
+        while True:
+            child = 2 * idx + 1
+            if child >= length:
+                break
+            right = child + 1
+            if right < length and utime.ticks_diff(heap[right]._next_run,
+                                                   heap[child]._next_run) < 0:
+                child = right
+            if utime.ticks_diff(heap[child]._next_run, task._next_run) >= 0:
+                break
+            heap[idx] = heap[child]
+            idx = child
+        heap[idx] = task
+
+
+    ## Build the static dispatch table used by the cyclic executive.
+    #
+    #  When every timed task has a fixed period, the schedule repeats every 
+    #  hyperperiod, the least common multiple of the periods. The hyperperiod
+    #  is cut into minor frames as long as the greatest common divisor of the
+    #  periods, and each timed task is put into every frame in which it is 
+    #  released: one frame in every period, starting from an offset chosen to
+    #  spread the work evenly over the frames. Tasks are placed from the 
+    #  shortest period to the longest, and within a frame are run from the 
+    #  highest priority down. @c cyclic_sched() then runs each frame's list
+    #  of tasks in turn, with no checking of whether tasks are ready.
+    #
+    #  A task's worst case run time is taken from the @c wcet dictionary if 
+    #  it is there, or else from the longest run time found by profiling, so
+    #  a profiled run with another scheduler can be used to measure it. The
+    #  timers of timer released tasks are switched off, since the table runs
+    #  those tasks from then on. Tasks with no period are run by 
+    #  @c cyclic_sched() between frames when their go flags are set. The 
+    #  table must be built again if tasks are appended or periods changed.
+    #
+    #  @param wcet A dictionary of worst case run times in microseconds, 
+    #         keyed by task name, or @c None to use profiled run times only
+    #  @return The largest load of any frame as a percentage of the frame
+    #  @raise ValueError if there are no timed tasks, if a task's run time 
+    #         is not known, or if the tasks will not fit into the frames
+    def build_cyclic(self, wcet=None):
+        tasks = [task for pri in self.pri_list for task in pri[2:]
+                 if task.period is not None]
+        if not tasks:
+            raise ValueError('No timed tasks for a cyclic schedule')
+
+        # The frame is the GCD and the hyperperiod the LCM of the periods
+        frame_us = tasks[0].period
+        hyper_us = tasks[0].period
+        for task in tasks:
+            frame_us = _gcd(frame_us, task.period)
+            hyper_us = hyper_us * task.period // _gcd(hyper_us, task.period)
+        n_frames = hyper_us // frame_us
+
+        times = {}
+        for task in tasks:
+            time = wcet.get(task.name) if wcet else None
+            if time is None:
+                time = task._slowest
+            if time <= 0:
+                raise ValueError(f"Run time of {task.name} is not known")
+            times[task] = time
+
+        # Give each task the offset which keeps the fullest of its frames
+        # as empty as possible
+        loads = [0] * n_frames
+        frames = [[] for idx in range(n_frames)]
+        for task in sorted(tasks, key=lambda task: (task.period, -times[task])):
+            step = task.period // frame_us
+            best = None
+            for offset in range(step):
+                fullest = max(loads[offset::step])
+                if best is None or fullest < best_load:
+                    best = offset
+                    best_load = fullest
+            if best_load + times[task] > frame_us:
+                raise ValueError(f"{task.name} does not fit: it takes "
+                    f"{times[task]} us and its frames have only "
+                    f"{frame_us - best_load} us left")
+            for idx in range(best, n_frames, step):
+                loads[idx] += times[task]
+                frames[idx].append(task)
+
+        # Flatten the frames into one tuple of tasks, with the index of each
+        # frame's first task in the table
+        self._cyc_tasks = []
+        self._cyc_start = array.array('I', [0] * (n_frames + 1))
+        for idx in range(n_frames):
+            frames[idx].sort(key=lambda task: task.priority, reverse=True)
+            self._cyc_tasks.extend(frames[idx])
+            self._cyc_start[idx + 1] = len(self._cyc_tasks)
+        self._cyc_tasks = tuple(self._cyc_tasks)
+        self._cyc_events = [task for pri in self.pri_list for task in pri[2:]
+                            if task.period is None]
+
+        # The table runs the timer released tasks from now on
+        for task in tasks:
+            if isinstance(task, TimerTask):
+                task.timer.callback(None)
+                task.go_flag = False
+
+        ## The load of each frame in microseconds of worst case run time
+        self.frame_loads = loads
+        ## The number of frames whose tasks ran past the end of the frame
+        self.frame_overruns = 0
+        ## The latest that any frame has been started, in microseconds
+        self.frame_late = 0
+        self._frame_us = frame_us
+        self._hyper_us = hyper_us
+        self._frame = 0
+        self._frame_start = clock.ticks_us()
+        return 100.0 * max(loads) / frame_us
+
+
+    ## Run the tasks in the next frame of the cyclic executive's table if the
+    #  frame is due to start; otherwise run a task with no period whose go
+    #  flag has been set. Frames keep to their schedule, so a frame whose
+    #  tasks run too long makes the following frames start late rather than
+    #  moving the schedule. @c build_cyclic() must be called first.
+    #  @return @c True if any task was run, @c False if none was ready
+    @micropython.native
+    def cyclic_sched(self):
+        late = utime.ticks_diff(clock.ticks_us(), self._frame_start)
+        if late >= 0:
+            if late > self.frame_late:
+                self.frame_late = late
+            # Timer released tasks measure their latency from the frame start
+            idx = self._frame
+            start = self._frame_start
+            tasks = self._cyc_tasks
+            for pos in range(self._cyc_start[idx], self._cyc_start[idx + 1]):
+                task = tasks[pos]
+                task._release_time = start
+                task.run()
+
+            self._frame_start = utime.ticks_diff(self._frame_us, 
+                                                 -self._frame_start)
+            if utime.ticks_diff(clock.ticks_us(), self._frame_start) > 0:
+                self.frame_overruns += 1
+            idx += 1
+            if idx >= len(self._cyc_start) - 1:
+                idx = 0
+            self._frame = idx
+            return True
+
+        for task in self._cyc_events:
+            if task.ready():
+                task.run()
+                return True
+
+        return False
+
+
+    ## Make a string describing the cyclic executive's schedule: its frame
+    #  length and hyperperiod, how full the frames are, and how well the 
+    #  frames have kept to time. 
+    #  @return The description, or an empty string if there is no schedule
+    def cyclic_report(self):
+        if self._cyc_start is None:
+            return ''
+        loads = self.frame_loads
+        return (f"Cyclic schedule: {len(loads)} frames of "
+                f"{self._frame_us / 1000:.3f} ms, hyperperiod "
+                f"{self._hyper_us / 1000:.1f} ms\n"
+                f"Frame load max {100 * max(loads) / self._frame_us:.1f}% "
+                f"avg {100 * sum(loads) / len(loads) / self._frame_us:.1f}%, "
+                f"{self.frame_overruns} frames overran, latest start "
+                f"{self.frame_late / 1000:.3f} ms\n")
+
+
+    ## Wait until a task is ready to run, sleeping the CPU when possible.
+    #
+    #  This method is called when a scheduler has found nothing to run. It 
+    #  finds the time until the earliest timed task is due and, while that 
+    #  time is long enough, sleeps until the next interrupt with 
+    #  @c machine.idle(). Every wake-up checks the go flags, so a task 
+    #  released by an interrupt service routine calling @c go() ends the 
+    #  wait early. The time spent here is counted as idle time for 
+    #  @c utilization(), and the part of it spent asleep is counted for 
+    #  @c sleep_fraction(), less any time taken by tasks run from 
+    #  @c micropython.schedule() meanwhile. When a virtual clock is in use, 
+    #  the clock is moved forward to the next release instead, and the time
+    #  it is moved by is counted as asleep for waits long enough that the 
+    #  board would sleep through them.
+    #
+    #  @b Example:
+    #    @code
+    #       while True:
+    #           if not cotask.task_list.pri_sched ():
+    #               cotask.task_list.idle ()
+    #    @endcode
+    def idle(self):
+        start = clock.ticks_us()
+        stolen = scheduled_us
+        sleep_us = getattr(clock, 'sleep_us', None) if clock is not utime \
+            else None
+        asleep = 0
+        while True:
+            wait = self.time_to_next()
+            if wait <= 0:
+                break
+            if wait > self.min_sleep_us or sleep_us:
+                sleep_start = clock.ticks_us()
+                sleep_stolen = scheduled_us
+                if sleep_us:
+                    sleep_us(wait)
+                else:
+                    machine.idle()
+                if wait > self.min_sleep_us:
+                    asleep += utime.ticks_diff(clock.ticks_us(), sleep_start) \
+                        - utime.ticks_diff(scheduled_us, sleep_stolen)
+        self._count_idle(utime.ticks_diff(clock.ticks_us(), start) 
+                         - utime.ticks_diff(scheduled_us, stolen), asleep)
+
+
+    ## Add the time spent in one call to @c idle() to the idle and sleep 
+    #  totals. The totals are kept in whole milliseconds, with the 
+    #  microseconds left over carried to the next call, so they stay small 
+    #  integers for days of running and adding to them allocates no memory.
+    #  @param idle_us The time spent in @c idle() in microseconds
+    #  @param asleep_us The part of that time spent asleep in microseconds
+    def _count_idle(self, idle_us, asleep_us):
+        idle_us += self._idle_rem
+        asleep_us += self._asleep_rem
+        self.idle_ms += idle_us // 1000
+        self.asleep_ms += asleep_us // 1000
+        self._idle_rem = idle_us % 1000
+        self._asleep_rem = asleep_us % 1000
+
+
+    ## Find how long it will be until some task is ready to run.
+    #  @return The time in microseconds until the earliest timed task is due,
+    #          @c 0 if a task is due or has had @c go() called, or a large
+    #          number if no task can become ready on its own
+    @micropython.native
+    def time_to_next(self):
+        now = clock.ticks_us()
+
+        # The cyclic executive runs timed tasks only at the start of frames
+        if self._cyc_start is not None:
+            wait = utime.ticks_diff(self._frame_start, now)
+            for task in self._cyc_events:
+                if task.go_flag:
+                    return 0
+                if task._wake_time is not None:
+                    until = utime.ticks_diff(task._wake_time, now)
+                    if until < wait:
+                        wait = until
+            return wait if wait > 0 else 0
+
+        # A blocked task is due at the end of its timeout, if it has one, 
+        # rather than at its next release
+        wait = 0x10000000
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                if task.go_flag:
+                    return 0
+                if task._blocked:
+                    if task._wake_time is None:
+                        continue
+                    until = utime.ticks_diff(task._wake_time, now)
+                elif task.period != None:
+                    until = utime.ticks_diff(task._next_run, now)
+                else:
+                    continue
+                if until < wait:
+                    wait = until
+        return wait if wait > 0 else 0
+
+
+    ## Find the fraction of time since @c reset_utilization() during which 
+    #  the CPU was busy, meaning not waiting in @c idle().
+    #  @return The CPU utilization in percent
+    def utilization(self):
+        total_ms = utime.ticks_diff(clock.ticks_ms(), self._util_start)
+        if total_ms <= 0:
+            return 0.0
+        return 100.0 * (total_ms - self.idle_ms) / total_ms
+
+
+    ## Find the fraction of time since @c reset_utilization() during which 
+    #  the CPU was asleep in @c idle() rather than polling for the next 
+    #  release.
+    #  @return The time asleep in percent
+    def sleep_fraction(self):
+        total_ms = utime.ticks_diff(clock.ticks_ms(), self._util_start)
+        if total_ms <= 0:
+            return 0.0
+        return 100.0 * self.asleep_ms / total_ms
+
+
+    ## Reset the idle time accounting used by @c utilization() and 
+    #  @c sleep_fraction().
+    def reset_utilization(self):
+        self.idle_ms = 0
+        self.asleep_ms = 0
+        self._idle_rem = 0
+        self._asleep_rem = 0
+        self._util_start = clock.ticks_ms()
+
+
+    ## Create a table showing the 50th, 95th and 99th percentiles of run 
+    #  duration and release lateness for each profiled task, in milliseconds.
+    #  @return The table as a string
+    def percentiles(self):
+        ret_str = 'TASK             DUR P50   DUR P95   DUR P99  LATE P50' \
+            '  LATE P95  LATE P99\n'
+        for task in self._all_tasks():
+            ret_str += task.get_percentiles() + '\n'
+        return ret_str
+
+
+    ## Get every task in the list, each followed by the members of any task
+    #  group, in the order the task list table shows them.
+    #  @return A generator of the tasks
+    def _all_tasks(self):
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                yield task
+                for member in getattr(task, 'members', ()):
+                    yield member
+
+
+    ## Write the transition traces of all traced tasks in the list to a 
+    #  stream, one after another in the format of @c Task.dump_trace().
+    #  @param stream The stream, such as a @c UART, to which traces are written
+    def dump_traces(self, stream):
+        for task in self._all_tasks():
+            if task._trace:
+                task.dump_trace(stream)
+
+
+    ## Create some diagnostic text showing the tasks in the task list.
+    def __repr__(self):
+        ret_str = 'TASK             PRI    PERIOD    RUNS  MISSED   AVG DUR' \
+            '   MAX DUR  AVG LATE  MAX LATE\n'
+        for task in self._all_tasks():
+            ret_str += str(task) + '\n'
+        if self.idle_ms:
+            ret_str += f"CPU utilization {self.utilization():.1f}%, " \
+                f"asleep {self.sleep_fraction():.1f}%\n"
+        ret_str += self.cyclic_report()
 
         return ret_str
 
@@ -0,0 +1,82 @@
+"""!
+@file heading_estimator.py
+@brief A class used for estimating the robot's heading from gyroscope and Euler angle readings
+@details The heading is found by integrating the yaw rate, which is read often and cheaply,
+         and is pulled towards the BNO055's absolute Euler heading, which only needs to be
+         read now and then to remove gyroscope drift. Headings are kept between 0 and 360
+         degrees and differences between headings are wrapped so they never jump by 360.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+from ticks_compat import ticks_diff
+
+def wrap_180(angle):
+    '''!@brief Wraps an angle into the range -180 to 180 degrees.
+    @param angle the angle to wrap [deg]
+    @return The equivalent angle from -180 up to but not including 180 degrees
+    '''
+    return (angle + 180) % 360 - 180
+
+def heading_error(heading, reference):
+    '''!@brief Finds the signed difference between two headings without wrap-around jumps.
+    @param heading the heading being checked [deg]
+    @param reference the heading it is compared to [deg]
+    @return How far heading is past reference, from -180 to 180 degrees
+    '''
+    return wrap_180(heading - reference)
+
+class heading_estimator:
+    '''!@brief Estimates heading by integrating yaw rate with occasional absolute correction.
+    @details propagate() is called with every yaw rate sample and correct() is called with
+             every absolute Euler heading. Each correction moves the estimate part of the
+             way to the absolute heading, which removes drift without adding the noise
+             and latency of reading the absolute heading every sample. Both take the raw
+             integer readings kept by the BNO055 driver and scale them here, so the driver
+             makes no float objects.
+    '''
+    def __init__(self, gain=0.5, gyro_sign=-1, rate_unit=1/16, heading_unit=1/16):
+        '''!@brief Constructs a heading estimator.
+        @param gain fraction of the heading error removed by each correction, 0 to 1
+        @param gyro_sign sign relating the yaw rate to the change in heading. The BNO055
+               heading increases clockwise while the z-axis yaw rate is positive
+               counterclockwise, so the default is -1.
+        @param rate_unit size of one unit of the yaw rate given to propagate() [deg/s]
+        @param heading_unit size of one unit of the heading given to correct() [deg]
+        '''
+        self._gain = gain
+        self._rate_gain = gyro_sign*rate_unit/1_000_000 # heading change per unit of rate per us
+        self._heading_unit = heading_unit
+        self.heading = 0        # estimated heading [deg]
+        self._time = None       # time of the last yaw rate sample [us]
+        self.corrected = False  # True once an absolute heading has been applied
+
+    def propagate(self, yaw_rate, time_us):
+        '''!@brief Integrates a yaw rate sample into the heading estimate.
+        @param yaw_rate the yaw rate from the gyroscope [rate_unit]
+        @param time_us the time the sample was taken, from ticks_us() [us]
+        '''
+        if self._time is not None:
+            dt = ticks_diff(time_us, self._time) # [us]
+            self.heading = (self.heading + self._rate_gain*yaw_rate*dt) % 360
+        self._time = time_us
+
+    def correct(self, abs_heading):
+        '''!@brief Pulls the heading estimate towards an absolute heading to remove drift.
+        @details The first correction sets the estimate to the absolute heading.
+        @param abs_heading the absolute Euler heading from the IMU [heading_unit]
+        '''
+        abs_heading *= self._heading_unit
+        if self.corrected:
+            self.heading = (self.heading + self._gain*heading_error(abs_heading, self.heading)) % 360
+        else:
+            self.heading = abs_heading % 360
+            self.corrected = True
+
+    def error(self, reference):
+        '''!@brief Finds how far the estimated heading is past a reference heading.
+        @param reference the heading to compare against [deg]
+        @return The wrap-safe heading error from -180 to 180 degrees
+        '''
+        return heading_error(self.heading, reference)
@@ -0,0 +1,57 @@
+"""!
+@file host_compat.py
+@brief Stand-ins for the MicroPython modules which the scheduler uses, for running it on a PC.
+@details cotask and task_share import utime, machine, micropython and pyb on the board. On a
+         PC, under CPython or MicroPython's Unix port, which lack some of them, they import
+         the missing ones from here instead. Each module found is used as it is, so on the
+         Unix port only pyb, and perhaps machine, is stood in for. A stand-in has only what
+         the scheduler uses: utime is ticks_compat, nothing is compiled to native code, a
+         call given to micropython.schedule() is made at once rather than at the next safe
+         point, idling does nothing, and interrupts are never disabled, since nothing on a
+         PC interrupts a task.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+try:
+    import utime
+except ImportError:
+    import ticks_compat as utime
+
+try:
+    import micropython
+except ImportError:
+    class micropython:
+        '''!@brief Stands in for the micropython module.
+        '''
+        @staticmethod
+        def native(fun):
+            return fun
+
+        @staticmethod
+        def schedule(fun, arg):
+            fun(arg)
+
+try:
+    import machine
+except ImportError:
+    class machine:
+        '''!@brief Stands in for the machine module.
+        '''
+        @staticmethod
+        def idle():
+            pass
+
+try:
+    import pyb
+except ImportError:
+    class pyb:
+        '''!@brief Stands in for the pyb module.
+        '''
+        @staticmethod
+        def disable_irq():
+            return True
+
+        @staticmethod
+        def enable_irq(state=True):
+            pass
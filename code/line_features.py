@@ -0,0 +1,128 @@
+"""!
+@file line_features.py
+@brief A class used for classifying course features from a rolling history of line readings
+@details Keeps the most recent line sensor readings in a fixed-size ring buffer and sorts
+         each new sample into a feature such as a lost line, a gap between dashes, a
+         crossing line, the finish box, or a curve. All storage is allocated once when the
+         object is created and each sample is classified in constant time.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+from array import array
+from ticks_compat import ticks_diff
+
+# line feature numbers
+feat_line = 0          # following a straight line
+feat_lost = 1          # no line under the sensor for longer than a dash gap
+feat_dash_gap = 2      # short gap between the dashes of a dashed line
+feat_crossing = 3      # short full black reading from a line across the path
+feat_finish = 4        # long full black reading from the finish box
+feat_curve_left = 5    # line bending to the left
+feat_curve_right = 6   # line bending to the right
+
+# names of the line features, indexed by feature number
+feature_names = ('line', 'lost', 'dash gap', 'crossing', 'finish', 'curve left', 'curve right')
+
+class line_features:
+    '''!@brief A class used for classifying course features from recent line readings
+    @details Each call to update() stores a sample in the ring buffer, keeps a running
+             sum of the readings in the buffer and keeps the time at which the line was
+             first lost or seen full black, so classifying a sample never looks back
+             through the history. The lost and full black runs are measured in time
+             rather than in samples, so the thresholds hold whatever the sample rate.
+    '''
+    def __init__(self, size=16, lost_threshold=1500, gap_ms=100, cross_ms=300,
+                 curve_threshold=3000):
+        '''!@brief Constructs a line feature classifier.
+        @param size number of recent readings kept in the history
+        @param lost_threshold total normalized decay below which no line is seen [us]
+        @param gap_ms longest time without a line treated as a dash gap [ms]
+        @param cross_ms longest time reading full black treated as a crossing line [ms]
+        @param curve_threshold average reading over the history above which the line is curving
+        '''
+        self._size = size
+        self._lost_threshold = lost_threshold
+        self._gap_us = 1000*gap_ms
+        self._cross_us = 1000*cross_ms
+        self._curve_sum = curve_threshold*size # running sum equal to the curve threshold
+
+        self._readings = array('l', [0]*size)  # recent line readings
+        self._features = array('B', [0]*size)  # feature found for each recent reading
+        self.clear()
+
+    def clear(self):
+        '''!@brief Empties the history and resets the feature to line following.
+        '''
+        for idx in range(self._size):
+            self._readings[idx] = 0
+            self._features[idx] = feat_line
+        self._idx = 0        # index of the next sample to write
+        self._sum = 0        # sum of the readings in the history
+        self._lost = False   # True while the line is lost
+        self._black = False  # True while the sensor reads full black
+        self._run_start = 0  # time the line was lost or first read full black [us]
+        self.feature = feat_line
+
+    def update(self, reading, intensity, full_black, time_us):
+        '''!@brief Adds a line reading to the history and classifies it.
+        @param reading weighted average from the line sensor
+        @param intensity total normalized decay from the line sensor
+        @param full_black True if the whole sensor array read black
+        @param time_us time the reading was taken, from ticks_us() [us]
+        @return The feature number found for this sample
+        '''
+        # keep track of when the line was lost or the sensor went full black
+        lost = not full_black and intensity < self._lost_threshold
+        if (full_black and not self._black) or (lost and not self._lost):
+            self._run_start = time_us
+        self._black = full_black
+        self._lost = lost
+        if lost:
+            reading = 0      # a lost line says nothing about which way the line bends
+        run_us = ticks_diff(time_us, self._run_start)
+
+        # replace the oldest reading in the running sum with the new one
+        idx = self._idx
+        self._sum += reading - self._readings[idx]
+        self._readings[idx] = reading
+
+        # classify the sample
+        if full_black:
+            feature = feat_finish if run_us > self._cross_us else feat_crossing
+        elif lost:
+            feature = feat_lost if run_us > self._gap_us else feat_dash_gap
+        elif self._sum > self._curve_sum:
+            feature = feat_curve_left
+        elif self._sum < -self._curve_sum:
+            feature = feat_curve_right
+        else:
+            feature = feat_line
+
+        self._features[idx] = feature
+        self._idx = idx + 1 if idx + 1 < self._size else 0
+        self.feature = feature
+        return feature
+
+    def average(self):
+        '''!@brief Gets the average line reading over the history.
+        @return The average of the readings in the history
+        '''
+        return self._sum / self._size
+
+    def count(self, feature):
+        '''!@brief Counts how many samples in the history were found to be a given feature.
+        @param feature the feature number to count
+        @return The number of samples in the history with that feature
+        '''
+        total = 0
+        for found in self._features:
+            if found == feature:
+                total += 1
+        return total
+
+    def __repr__(self):
+        '''!@brief Shows the current feature and the average reading for diagnostic use.
+        '''
+        return f"{feature_names[self.feature]:<12s} avg {self.average(): 8.0f}"
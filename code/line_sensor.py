@@ -7,25 +7,104 @@
 
 # import modules
 import pyb
+import stm
+import micropython
 from pyb import Pin, UART, repl_uart
-from time import ticks_us, ticks_diff
+from time import ticks_us, ticks_ms, ticks_diff
+from array import array
+import struct
+
+# base addresses of the GPIO ports, indexed by Pin.port()
+gpio_ports = (stm.GPIOA, stm.GPIOB, stm.GPIOC, stm.GPIOD, stm.GPIOE)
+
+timeout_us = 2000         # longest decay time that is measured [us]
+black_threshold = 12000   # total normalized decay above which the whole array is black [us]
+sat_margin_us = 100       # margin past the longest black decay before a channel is saturated [us]
+probe_every = 32          # in adaptive mode, every Nth read uses the full window to relearn bounds
+
+# hundredths of the weight given to each channel for calculating weighted average
+weights = (-140, 140, -240, 240, -375, 375, -500, 500)
 
 class line_sensor:
     '''!@brief A class used for reading a line using the Pololu 8-Channel QTRX Sensor Array
     '''
-    def __init__(self, sensor_pins):
+    def __init__(self, sensor_pins, adaptive=False):
         '''!@brief Constructs an line sensor object.
         @param pins that connect to the sensor array
+        @param adaptive True to stop timing the decays once every channel is past its
+               learned black bound instead of waiting out the full timeout window
         '''
         self.sensors = [Pin(pin, mode=Pin.OUT_PP) for pin in sensor_pins] # initialize pins
+        
+        # The parallel read switches the pins between output and input through
+        # the MODER registers, so the output latch of every pin is left high
+        for sensor in self.sensors:
+            sensor.value(1)
+        
+        # input data register address and bit mask of every channel
+        self._idr = []       # IDR address of each GPIO port used by the array
+        self._chan_port = [] # index into self._idr for each channel
+        self._chan_mask = [] # IDR bit mask for each channel
+        
+        # MODER half-words (pins 0-7 and 8-15) which hold the mode bits of the array
+        self._moder = []     # MODER half-word addresses
+        self._moder_out = [] # bits which make the array pins outputs
+        self._moder_keep = [] # bits belonging to other pins on the port
+        
+        for sensor in self.sensors:
+            port = gpio_ports[sensor.port()]
+            idr = port + stm.GPIO_IDR
+            if idr not in self._idr:
+                self._idr.append(idr)
+            self._chan_port.append(self._idr.index(idr))
+            self._chan_mask.append(1 << sensor.pin())
+            
+            moder = port + stm.GPIO_MODER + 2*(sensor.pin() >> 3)
+            shift = 2*(sensor.pin() & 0x07)
+            if moder not in self._moder:
+                self._moder.append(moder)
+                self._moder_out.append(0)
+                self._moder_keep.append(0xFFFF)
+            idx = self._moder.index(moder)
+            self._moder_out[idx] |= 0x01 << shift
+            self._moder_keep[idx] &= ~(0x03 << shift)
+        
+        self._levels = [0]*len(self._idr)       # port snapshot used while timing
+        n_chan = len(self.sensors)
+        self._decays = array('H', [0]*n_chan)   # decay times from the last read
+        
+        # per-channel calibration bounds, the uncalibrated bounds are the full window
+        self._floor = array('H', [0]*n_chan)           # decay time over white
+        self._ceil = array('H', [timeout_us]*n_chan)   # decay time over black
+        
+        # normalization table built from the calibration bounds
+        self._span = array('l', [0]*n_chan)     # difference between ceiling and floor
+        self._norm = array('l', [0]*n_chan)     # gain stretching a channel to the window, Q10
+        self._coef = array('l', [0]*n_chan)     # weight times gain, Q10
+        self._sat_us = timeout_us               # decay time at which every channel is saturated
+        self._build_table()
+        
+        # adaptive early exit
+        self.adaptive = adaptive                # True to end reads at the saturation bound
+        self._window = timeout_us               # length of the current decay window
+        self._reads = 0                         # reads started, used to schedule probe reads
+        self.scan_us = 0                        # length of the last parallel read
+        self.scans = 0                          # number of parallel reads completed
+        self.saved_us = 0                       # total time saved by ending reads at the saturation bound
+        
+        self._pending = 0                       # channels still being timed
+        self._time_start = ticks_us()           # start of the current decay window
+        self._seen = 0                          # time of the last port sample in the window
+        self.reading = 0                        # weighted average from the last read
+        self.full_black = False                 # True if the last read was all black
+        self.intensity = 0                      # total normalized decay from the last read
     
     def read_line(self):
         '''!@brief Reads the sensor and outputs a weighted average of the readings
         '''
-        outputs = []                                       # init output list
-        scale = [-1.4, 1.4, -2.4, 2.4, -3.75, 3.75, -5, 5] # scale used for calculating weighted average 
+        decays = self._decays
         
-        for sensor in self.sensors:      # for each sensor
+        for chan, sensor in enumerate(self.sensors): # for each sensor
             sensor.init(mode=Pin.OUT_PP) # set pin to output
             sensor.value(1)              # drive it high
             pyb.udelay(10)               # wait 10 us for output to rise
@@ -34,26 +113,262 @@ class line_sensor:
             state = sensor.value()       # read pin
             
             # keep reading pin until it goes low or timesout
-            while state > 0 and ticks_diff(ticks_us(), time_start) < 2000:
+            while state > 0 and ticks_diff(ticks_us(), time_start) < timeout_us:
                 state = sensor.value() # read pin
                 
-            decay = ticks_diff(ticks_us(), time_start) # calculate length of decay
-            outputs.append(decay)                      # add measurement to list
+            decays[chan] = ticks_diff(ticks_us(), time_start) # calculate length of decay
 
-        # raise full_black flag if the total outputs are above a certain threshold
-        abs_reading = sum(outputs)
-        if abs_reading > 12000:     # if all measurements are above a threshold
-            self.full_black = True  # raise flag
-        else:                       # otherwise
-            self.full_black = False # lower flag
+        self.reading = self._weigh()
+        return self.reading
+    
+    def read_line_parallel(self):
+        '''!@brief Reads all channels in a single timeout window and outputs a weighted average
+        @details All eight pins are charged together, then the decay of every channel is
+                 timed at once by polling the GPIO input data registers in one loop. A full
+                 read is bounded by one 2000 us timeout window instead of one per channel.
+        '''
+        self.start_read()     # charge and release every channel
+        self.poll(timeout_us) # time the decays for the whole window
+        return self.reading
+    
+    def start_read(self):
+        '''!@brief Charges every channel at once and starts timing their decays
+        @details Used with poll() to spread a read over several scheduler runs. The
+                 charge takes about 10 us and nothing is waited on afterwards.
+        '''
+        mem16 = stm.mem16
+        
+        # charge every channel at once by making all array pins outputs
+        for idx in range(len(self._moder)):
+            addr = self._moder[idx]
+            mem16[addr] = (mem16[addr] & self._moder_keep[idx]) | self._moder_out[idx]
+        pyb.udelay(10) # wait 10 us for outputs to rise
+        
+        # release every channel at once by making all array pins inputs
+        for idx in range(len(self._moder)):
+            addr = self._moder[idx]
+            mem16[addr] = mem16[addr] & self._moder_keep[idx]
+        self._time_start = ticks_us()
+        self._seen = 0
+        
+        self._pending = (1 << len(self._decays)) - 1 # bit i is set while channel i is still high
+        
+        # In adaptive mode time only up to the saturation bound, except for an
+        # occasional probe read over the full window to relearn the bounds
+        self._reads += 1
+        if self.adaptive and self._reads % probe_every:
+            self._window = self._sat_us
+        else:
+            self._window = timeout_us
+    
+    @micropython.native
+    def poll(self, budget):
+        '''!@brief Times the channel decays started by start_read() for a limited time
+        @details Samples the GPIO input data registers for at most budget microseconds.
+                 When every channel has gone low or the decay window has passed, the
+                 weighted average is stored in reading and full_black is updated. In
+                 adaptive mode the window ends at the learned saturation bound. A channel
+                 found low is timed at the midpoint between that sample and the one before
+                 it. Within a call the samples are a few microseconds apart, and a decay
+                 which ended between two calls is timed to within half the gap between them.
+        @param budget the longest time in microseconds to keep sampling during this call
+        @return True once the read is complete, False if more polling is needed
+        '''
+        mem16 = stm.mem16
+        idr = self._idr
+        levels = self._levels
+        chan_port = self._chan_port
+        chan_mask = self._chan_mask
+        decays = self._decays
+        n_ports = len(idr)
+        n_chan = len(decays)
+        time_start = self._time_start
+        pending = self._pending
+        window = self._window
+        
+        seen = self._seen
+        elapsed = ticks_diff(ticks_us(), time_start)
+        stop = elapsed + budget
+        
+        # sample the ports until every channel has gone low, the read times out,
+        # or this call has used up its time budget
+        while pending and elapsed < window and elapsed < stop:
+            for port in range(n_ports):
+                levels[port] = mem16[idr[port]]
+            elapsed = ticks_diff(ticks_us(), time_start)
+            for chan in range(n_chan):
+                if pending & (1 << chan) and not levels[chan_port[chan]] & chan_mask[chan]:
+                    decays[chan] = (seen + elapsed) >> 1 # went low since the last sample
+                    pending &= ~(1 << chan)
+            seen = elapsed
+        
+        self._seen = seen
+        self._pending = pending
+        if pending and elapsed < window: # still waiting on some channels
+            return False
+        
+        # channels which never went low are given the full window
+        for chan in range(n_chan):
+            if pending & (1 << chan):
+                decays[chan] = elapsed
+        self._pending = 0
         
-        # scale outputs by multiplying each measurement by a weight
-        for instance in range(8):
-            outputs[instance] *= scale [instance]
+        # keep track of the time saved when the saturation bound ended the read, since
+        # a read in which every channel went low ends early in either mode
+        self.scan_us = elapsed
+        self.scans += 1
+        if pending and self._window < timeout_us:
+            self.saved_us += timeout_us - elapsed
         
-        reading = sum(outputs) # add all outputs
+        if self.adaptive:
+            self._learn()
         
-        return reading
+        self.reading = self._weigh()
+        return True
+    
+    def _learn(self):
+        '''!@brief Widens the calibration bounds with the decay times from the last read
+        @details A decay shorter than a channel's floor lowers the floor. Reads which end
+                 at the saturation bound cannot show a longer black decay, so the ceiling
+                 is only raised by probe reads over the full window.
+        '''
+        decays = self._decays
+        floor = self._floor
+        ceil = self._ceil
+        probe = self._window >= timeout_us
+        changed = False
+        
+        for chan in range(len(decays)):
+            if decays[chan] < floor[chan]:
+                floor[chan] = decays[chan]
+                changed = True
+            elif probe and ceil[chan] < decays[chan] < timeout_us:
+                ceil[chan] = decays[chan]
+                changed = True
+        
+        if changed:
+            self._build_table()
+    
+    def scan_stats(self):
+        '''!@brief Returns a string showing the time saved by ending reads at the saturation bound
+        '''
+        avg_saved = self.saved_us / self.scans if self.scans else 0
+        return (f"window {self._sat_us if self.adaptive else timeout_us} us, last scan {self.scan_us} us, "
+                f"avg saved {avg_saved:.0f} us over {self.scans} scans")
+    
+    def calibrate(self, duration_ms):
+        '''!@brief Sweeps the sensor to find the floor and ceiling decay time of each channel
+        @details Reads the array repeatedly for the given time while the sensor is moved
+                 back and forth across the line, keeping the shortest (white) and longest
+                 (black) decay seen on every channel. The normalization table is rebuilt
+                 from the new bounds at the end of the sweep.
+        @param duration_ms length of the sweep in milliseconds
+        '''
+        floor = self._floor
+        ceil = self._ceil
+        decays = self._decays
+        adaptive = self.adaptive
+        self.adaptive = False # time the full window during the sweep
+        
+        # start from bounds which any reading will widen
+        for chan in range(len(decays)):
+            floor[chan] = timeout_us
+            ceil[chan] = 0
+        
+        time_start = ticks_ms()
+        while ticks_diff(ticks_ms(), time_start) < duration_ms:
+            self.read_line_parallel()
+            for chan in range(len(decays)):
+                if decays[chan] < floor[chan]:
+                    floor[chan] = decays[chan]
+                if decays[chan] > ceil[chan]:
+                    ceil[chan] = decays[chan]
+        
+        self.adaptive = adaptive
+        self._build_table()
+    
+    def save_calibration(self, filename='line_calibration.bin'):
+        '''!@brief Saves the floor and ceiling decay time of each channel to a binary file
+        @param filename name of the calibration file
+        '''
+        with open(filename, 'wb') as file:
+            file.write(self._floor)
+            file.write(self._ceil)
+    
+    def load_calibration(self, filename='line_calibration.bin'):
+        '''!@brief Loads the floor and ceiling decay time of each channel from a binary file
+        @details Rebuilds the normalization table from the loaded bounds. If there is no
+                 calibration file, or it is truncated or was saved for a different number
+                 of channels, the current table is kept.
+        @param filename name of the calibration file
+        @return True if a calibration was loaded, False if there is no usable calibration file
+        '''
+        try:
+            with open(filename, 'rb') as file:
+                buf = file.read()
+        except OSError:
+            return False
+        
+        n_chan = len(self._decays)
+        if len(buf) != 4*n_chan: # truncated, or saved for another array
+            return False
+        
+        bounds = struct.unpack(f'<{2*n_chan}H', buf)
+        for chan in range(n_chan):
+            self._floor[chan] = bounds[chan]
+            self._ceil[chan] = bounds[n_chan + chan]
+        self._build_table()
+        return True
+    
+    def _build_table(self):
+        '''!@brief Precomputes the integer normalization table from the channel bounds
+        @details Each channel's decay is clamped to its floor and ceiling and stretched to
+                 the full timeout window, so the table holds the span of each channel and
+                 Q10 fixed point gains for the intensity and the weighted average. The
+                 saturation bound used by adaptive reads is the longest ceiling plus a margin.
+        '''
+        sat_us = 0
+        for chan in range(len(self._decays)):
+            if self._ceil[chan] > sat_us:
+                sat_us = self._ceil[chan]
+            
+            span = self._ceil[chan] - self._floor[chan]
+            if span < 1:
+                span = 1
+            norm = (timeout_us << 10) // span
+            self._span[chan] = span
+            self._norm[chan] = norm
+            self._coef[chan] = (weights[chan]*norm) // 100
+        self._sat_us = min(sat_us + sat_margin_us, timeout_us)
+    
+    @micropython.native
+    def _weigh(self):
+        '''!@brief Sets the full_black flag and returns the weighted average of the decay times
+        @details Normalizes the decay times from the last read with the precomputed table.
+                 Only integer math on preallocated arrays is used, so nothing is allocated.
+        '''
+        decays = self._decays
+        floor = self._floor
+        span = self._span
+        norm = self._norm
+        coef = self._coef
+        
+        reading = 0   # weighted average in Q10
+        intensity = 0 # sum of normalized decays in Q10
+        for chan in range(len(decays)):
+            decay = decays[chan] - floor[chan] # clamp the decay between floor and ceiling
+            if decay < 0:
+                decay = 0
+            elif decay > span[chan]:
+                decay = span[chan]
+            reading += decay*coef[chan]
+            intensity += decay*norm[chan]
+        
+        # raise full_black flag if the total intensity is above a certain threshold
+        self.intensity = intensity >> 10
+        self.full_black = self.intensity > black_threshold
+        
+        return reading >> 10
 
 if __name__ == "__main__":
     
@@ -68,8 +383,15 @@ if __name__ == "__main__":
     # sensor_pins = [Pin.cpu.C0, Pin.cpu.A6, Pin.cpu.C1, Pin.cpu.A7, 
     #                Pin.cpu.B0, Pin.cpu.B1, Pin.cpu.A4, Pin.cpu.C3]
     
-    qtr = line_sensor(sensor_pins)
+    qtr = line_sensor(sensor_pins, adaptive=True)
+    
+    # sweep the sensor across the line if there is no saved calibration
+    if not qtr.load_calibration():
+        print('Sweep the sensor across the line for 5 seconds')
+        qtr.calibrate(5000)
+        qtr.save_calibration()
+    print(f"floor {list(qtr._floor)} ceiling {list(qtr._ceil)}")
     
     while True:
-        qtr.read_line()
-        print(qtr.full_black)
+        qtr.read_line_parallel()
+        print(qtr.full_black, qtr.scan_stats())
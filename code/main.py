@@ -19,18 +19,20 @@ The standard control scheme uses a robot control task that takes in yaw rate and
 information, and feeds wheel speed setpoints to the motor control tasks.
 """
 
-# Import modules
-from pyb import Pin, Timer, UART, repl_uart, ExtInt
+# Import modules. The hardware drivers are imported by the main program below, so the tasks can also be imported
+# on a PC by sim_sched.py
 import gc
-import machine
 import cotask
 import task_share
-from encoder import encoder
-from Romi_Motor import Romi_Motor             
-from BNO055 import BNO055
-from time import ticks_us, ticks_diff, sleep_ms
+from BNO055 import BNO055, list_profiles
+from ticks_compat import ticks_us, ticks_diff
 from math import pi
-from line_sensor import line_sensor
+from line_features import line_features, feat_dash_gap, feat_crossing, feat_finish
+from heading_estimator import heading_estimator, heading_error
+import sched_analysis
+
+w = .141 # robot track width [m]
+r = .035 # robot wheel radius [m]
 
 # Blue user button function
 def user_button_toggle(pressed):
@@ -41,6 +43,8 @@ def user_button_toggle(pressed):
 def bump_toggle(pressed):
     global bump_detected
     bump_detected = True
+    if bump_task is not None:
+        bump_task.go() # run the driving mode task at the next scheduler pass rather than at its next period
     print('Hey! Who put that there?')
     # The bump sensors have a small amount of signal bouncing - this
     # is handled by not resetting the bump_detected flag until the
@@ -55,10 +59,11 @@ def planner(shares):
     global user_button_pressed, bump_detected # list global variables
     
     # get references to the shares and queues which have been passed to this task
-    my_velocity_setpoint, my_yaw_setpoint, my_control_flag, my_calibration_flag = shares
+    my_setpoint, my_control_flag, my_calibration_flag = shares
     
     state = 0                  # initialize state
     calibrated = False         # initialize calibration
+    profile_checked = False    # initialize saved calibration profile check
     my_calibration_flag.put(0) # initialize calibration flag
 
     while True:
@@ -80,28 +85,25 @@ def planner(shares):
             if user_button_pressed == True:
                 user_button_pressed = False    # if so, reset the user button flag
                 my_control_flag.put(1)         # raise control flag       
-                my_velocity_setpoint.put(V)    # set velocity for robot control task
-                my_yaw_setpoint.put(0)         # set yaw rate for robot control task
+                my_setpoint.put_fields(V, 0)   # set velocity and yaw rate for robot control task together
             yield(state)
         
         elif (state == 2):                           # calibration state
             
-            file_known = False                       # initialize flag
-            calibrated = False                       # initialize calibration status
-        
-            try:                                     # try to open calibration file
-                with open('calibration.bin', 'r'):
-                    file_known = True                # set flag
-            except OSError:                          # if there is no calibration file
-                print('Perform manual calibration')  # notify user
-        
-            if file_known:
+            if not profile_checked:                  # only look for a saved profile once
+                profile_checked = True
                 try:
-                    IMU.set_offsets()                # calibrate using file data
-                    calibrated = True                # set calibrated
-                except OSError:                      # if there is an error using the file
-                    raise OSError('''Error accessing calibration.bin. Remove calibration.bin from the nucleo and restart program to perform manual calibration''')
-                                  
+                    if 'default' in list_profiles():     # if there is a saved calibration profile
+                        IMU.load_profile('default')      # validate, apply and confirm the profile
+                        calibrated = True                # set calibrated
+                        print('IMU calibrated from saved profile')
+                    elif IMU.convert_legacy('default'):  # otherwise use a calibration.bin saved before profiles
+                        calibrated = True                # set calibrated
+                        print('IMU calibrated from calibration.bin, saved as profile default')
+                except (OSError, ValueError) as err:     # if the calibration is damaged or was not applied
+                    print(f'Calibration profile rejected: {err}')
+                if not calibrated:
+                    print('Perform manual calibration')  # notify user
         
             if not calibrated:                       # if still not calibrated
                 IMU.read_cal_status()                # read calibration status
@@ -112,7 +114,11 @@ def planner(shares):
                     and IMU.sys_cal_status == 3):    # if all calibrated
                     calibrated = True                # set calibrated
                     print('IMU Calibrated')          # notify user
-                    my_calibration_flag.put(1)
+                    IMU.save_profile('default')      # save the calibration for the next boot
+            
+            if calibrated:
+                my_calibration_flag.put(1)           # raise calibration flag
+                print(f'IMU ready {ticks_diff(ticks_us(), boot_time)//1000} ms after boot')
                     
             state = 0                                # set init state
             yield(state)
@@ -120,16 +126,58 @@ def planner(shares):
         else: # if state isnt found
             raise ValueError('Invalid state')
 
+def imu_sampling(shares):
+    """!
+    Task which samples the IMU at a fixed rate and publishes the yaw rate and heading along with the time
+    the sample was taken. This is the only task which reads IMU data over I2C, so other tasks use the
+    cached sample and can check its age with the timestamp. The heading is estimated by integrating the
+    yaw rate every run, and the absolute Euler heading is only read every few runs to correct gyro drift.
+    @param shares A tuple of a share and queue from which this task gets data
+    """
+    # get references to the shares and queues which have been passed to this task
+    my_yaw_rate, my_heading, my_imu_time = shares
+    
+    correct_every = 20  # number of runs between absolute heading corrections
+    rad_per_unit = 0.01745/16 # [rad/s] yaw rate of one unit read from the IMU, which is 1/16 deg/s
+    runs = 0            # runs since the last absolute heading correction
+    state = 0           # initialize state
+    
+    while True:
+        if state == 0:                            # State 0: sample IMU
+            if runs == 0:
+                IMU.read_gyr_euler()              # read yaw rate and absolute heading in one transaction
+            else:
+                IMU.read_gyr()                    # read yaw rate only
+            time_sample = ticks_us()              # record when the sample was taken
+            
+            # integrate the yaw rate, then correct with the absolute heading if one was read
+            heading_est.propagate(IMU.gyr[2], time_sample)
+            if runs == 0:
+                heading_est.correct(IMU.euler[0])
+            runs += 1
+            if runs >= correct_every:
+                runs = 0
+            
+            my_imu_time.put(time_sample)
+            my_yaw_rate.put(IMU.gyr[2]*rad_per_unit) # [rad/s] convert yaw rate from IMU units to rad/s
+            my_heading.put(heading_est.heading)   # [deg]
+            yield(state)
+            
+        else:                   # if state isnt found
+            raise ValueError('Invalid state')
+
 def robot_control(shares):
     """!
     Controller task which calculates omega setpoints for the motors using translationa velocity and yaw data.
+    The age of the IMU sample used each run is found from its timestamp, and the oldest is kept for the report at exit.
     Comment out this task and follow other instructions in the code to bypass the robot control.
     @param shares A tuple of a share and queue from which this task gets data
     """
-    global w, r # list global variables
+    global w, r, imu_age_max # list global variables
     
     # get references to the shares and queues which have been passed to this task
-    my_velocity_setpoint, my_yaw_setpoint, my_control_flag, my_omega_L_setpoint, my_omega_R_setpoint, my_omega_L_actual, my_omega_R_actual = shares
+    my_setpoint, my_control_flag, my_omega_L_setpoint, my_omega_R_setpoint, my_omega_L_actual, my_omega_R_actual, my_yaw_rate, my_imu_time = shares
+    setpoints = my_setpoint.new_buffer() # buffer for snapshots of the velocity and yaw rate setpoints
     
     V_err = 0       # zero error
     yaw_err = 0     # zero error
@@ -148,18 +196,20 @@ def robot_control(shares):
         control_on = my_control_flag.get() # get control flag
         
         if state == 0:            # State 0: Robot Control off
-            time_old = ticks_us() # continuously update old time while off
+            time_old = ticks_us() # update old time when woken
             if control_on == 0:   # set to control state if flag raised
-                pass
+                task2.set_period(None) # sleep until the control flag changes
             else:
+                task2.set_period(5)    # run every 5 ms while controlling
                 state = 1         # set control state
             yield(state)                   
             
         elif state == 1: # State 1: Apply control     
 
             # get values from shares
-            V_ref = my_velocity_setpoint.get()
-            yaw_ref = my_yaw_setpoint.get()
+            my_setpoint.get_into(setpoints) # read both setpoints from the same write
+            V_ref = setpoints[0]
+            yaw_ref = setpoints[1]
             omega_L_act = my_omega_L_actual.get()
             omega_R_act = my_omega_R_actual.get()
             
@@ -171,9 +221,11 @@ def robot_control(shares):
             # calculate actual translational velocity based on current wheel velocity
             V_act = (r/2)*(omega_L_act + omega_R_act)     
             
-            # read actual yaw rate from IMU
-            IMU.read_gyr()              
-            yaw_act = IMU.gyr_z*0.01745 # [rad/s] convert yaw rate from deg/s to rad/s
+            # get actual yaw rate sampled by the IMU task
+            yaw_act = my_yaw_rate.get() # [rad/s]
+            imu_age = ticks_diff(time_new, my_imu_time.get()) # [us] time since the yaw rate was sampled
+            if imu_age > imu_age_max:
+                imu_age_max = imu_age
       
             # calculate errors
             V_err = V_ref - V_act
@@ -267,11 +319,12 @@ def motor_L_control(shares):
 
 def motor_R_control(shares):
     """!
-    Task which controls the velocity of the right motor by applying proportional and integral control to the velocity error
+    Task which controls the velocity of the right motor by applying proportional and integral control to the velocity error.
+    The wheel position is published every run so other tasks can measure distances without reading the encoder.
     @param shares is a tuple of a share and queue from which this task gets data
     """
     # get references to the shares and queues which have been passed to this task
-    my_omega_R_setpoint, my_omega_R_actual, my_control_flag = shares
+    my_omega_R_setpoint, my_omega_R_actual, my_control_flag, my_position_R = shares
     
     state = 0       # initialize state
     mot_R.disable() # disable motor
@@ -285,6 +338,7 @@ def motor_R_control(shares):
         if state == 0:        # State 0: Motor Off
             
             enc_R.update()    # continuously update encoder while off
+            my_position_R.put(enc_R.get_position()) # publish wheel position
             if motor_on == 0: # set to control state if flag raised
                 pass
             else:
@@ -300,6 +354,7 @@ def motor_R_control(shares):
             
             # update encoder and get dt
             enc_R.update()
+            my_position_R.put(enc_R.get_position()) # publish wheel position
             dt = enc_R.get_dt()/1_000_000 # [s]
             
             # calculate omega actual
@@ -321,17 +376,57 @@ def motor_R_control(shares):
                 state = 0         # set off state
             yield(state)
             
+def line_sensing(shares):
+    """!
+    Task which reads the line sensor without blocking the scheduler. The channels are charged and sampled
+    for one short slice in one run, then their decays are timed in slices over the following runs, so no
+    run holds the CPU for more than about 50 us. A decay which ends during a slice is timed to a few
+    microseconds. One which ends between slices is timed at the middle of the gap, to within half of it,
+    about 0.23 ms at a 0.5 ms period; the period sets this resolution and is kept as short as the
+    scheduler allows. Each finished reading is published to the line reading share and the full black
+    flag is kept on the sensor object. Each reading is also added to the line feature history, and the feature found is published so other
+    tasks can react to dashes, crossing lines and the finish box without reading the sensor.
+    @param shares is a tuple of a share and queue from which this task gets data
+    """
+    # get references to the shares and queues which have been passed to this task
+    my_line_reading, my_line_feature = shares
+    
+    slice_us = 40       # longest time spent sampling the sensor in one run [us]
+    state = 0           # initialize state
+    
+    while True:
+        if state == 0:                           # State 0: charge the sensor
+            qtr.start_read()                     # charge all channels and start timing
+            done = qtr.poll(slice_us)            # take the first slice at once so short decays are timed closely
+            
+        elif state == 1:                         # State 1: time the decays
+            done = qtr.poll(slice_us)            # sample for one slice
+            
+        else:                   # if state isnt found
+            raise ValueError('Invalid state')
+        
+        if done:                                 # publish a finished reading and start the next one
+            my_line_reading.put(qtr.reading)
+            my_line_feature.put(features.update(qtr.reading, qtr.intensity, qtr.full_black, ticks_us()))
+            state = 0
+        else:
+            state = 1
+        yield(state)
+
 def driving_mode(shares):
     """!
     Task which handles the line following and obstacle avoidance behavior of the robot. The robot
     follows the line until a bump is detected, drives around the obstacle, and returns to line
-    following until reaching the finish line, where the robot then returns to the start.
+    following until reaching the finish line, where the robot then returns to the start. Black
+    lines across the path are found from the line feature published by the line sensing task, and
+    the yaw rate is held across the gaps of a dashed line. Distances are measured from the right
+    wheel position published by the motor task, which is the only task that reads the encoder.
     @param shares is a tuple of a share and queue from which this task gets data 
     """
     global bump_detected # list global variables
     
     # get references to the shares and queues which have been passed to this task
-    my_velocity_setpoint, my_yaw_setpoint, my_control_flag, my_calibration_flag = shares
+    my_setpoint, my_control_flag, my_calibration_flag, my_line_reading, my_line_feature, my_heading, my_position_R = shares
     
     V = .10                             # user input robot translational velocity [m/s]
     w = .141                            # robot track width [m]
@@ -342,6 +437,7 @@ def driving_mode(shares):
     
     # init variables
     after_wall = False  # flag that is raised once the obstacle has been cleared
+    line_version = -1   # version of the line reading last used to set the yaw, -1 to use the next reading
     state = 0
     
     while True:
@@ -351,98 +447,100 @@ def driving_mode(shares):
             if calibrated == 0:                        # ignore bump detection before calibration
                 bump_detected = False
             if control_on == 1:                        # set to control state if flag raised
-                IMU.read_euler()                       # read the IMU
-                starting_heading = IMU.euler_heading   # retrieve the robots heading to allow it to return to the start
-                enc_R.zero()                           # clear encoder position
+                starting_heading = my_heading.get()    # retrieve the robots heading to allow it to return to the start
+                start_position = my_position_R.get()   # measure distance from here
+                task5.set_period(25)                   # run every 25 ms while driving
                 state = 3                              # set leave box
+            else:
+                task5.set_period(None)                 # sleep until a flag changes or a bump is detected
             yield(state)                   
         
         elif state == 1:                                        # line follow state
+            feature = my_line_feature.get()                     # get the course feature under the sensor
+            full_black = feature == feat_crossing or feature == feat_finish
             if bump_detected:                                   # if there is a bump
                 my_control_flag.put(0)                          # turn off motors
-                enc_R.zero()                                    # clear encoder
+                start_position = my_position_R.get()            # measure distance from here
                 section_complete = False                        # Initialize square section completion flag
                 square_idx = 1                                  # Init square index
                 state = 2                                       # set square driving state
-            elif after_wall == True and qtr.full_black == True: # if robot crosses black line after bumping wall, it's at the finish line
-                my_velocity_setpoint.put(V)                     # set velocity
-                my_yaw_setpoint.put(0)                          # set yaw
-                enc_R.zero()                                    # clear encoder
+            elif after_wall == True and full_black == True:     # if robot crosses black line after bumping wall, it's at the finish line
+                my_setpoint.put_fields(V, 0)                    # set velocity and yaw
+                start_position = my_position_R.get()            # measure distance from here
                 after_wall = False                              # reset flag for future runs
                 return_idx = 1                                  # initialize return sequence index
                 state = 4                                       # set turn around state
             else:                                               # otherwise
-                yaw = qtr.read_line()/1500                      # read line and scale measurement
-                if qtr.full_black:                              # if the robot senses a prependicular line
-                    my_yaw_setpoint.put(0)                      # set yaw to zero to minimize "twitching"
+                if full_black:                                  # if the robot senses a prependicular line
+                    my_setpoint.put_field('yaw', 0)             # set yaw to zero to minimize "twitching"
+                    line_version = -1                           # use the next line reading even if it hasn't changed
+                elif feature == feat_dash_gap:                  # if the robot is between the dashes of a dashed line
+                    pass                                        # keep the yaw set from the last dash
                 else:
-                    my_yaw_setpoint.put(yaw)                    # Set yaw based on line reading
+                    new_reading = my_line_reading.get_if_changed(line_version) # skip the update until there is a new reading
+                    if new_reading is not None:
+                        reading, line_version = new_reading
+                        my_setpoint.put_field('yaw', reading/1500) # Set yaw based on the scaled line reading
             yield(state)   
             
         elif state == 2:                          # drive in square state
-            enc_R.update()                        # Update encoder position
-            position = abs(enc_R.get_position())  # Get position magnitude
+            position = abs(my_position_R.get() - start_position) # Distance driven in this step
             
             if square_idx == 1 and not section_complete:  # Step 1: Back up
-                my_velocity_setpoint.put(-V)  # Set reverse velocity
-                my_yaw_setpoint.put(0)        # No yaw change
+                my_setpoint.put_fields(-V, 0) # Set reverse velocity, no yaw change
                 my_control_flag.put(1)        # Start movement
                 if position > drive_3 / 2:    # Condition to finish backing up
                     my_control_flag.put(0)    # turn off control so the robot stops at each step
                     square_idx += 1           # increase the square path index
-                    enc_R.zero()              # zero encoders
+                    start_position = my_position_R.get() # measure distance from here
                     section_complete = True   # raise section complete flag so the next square step isn't entered immediately
             
             elif square_idx in [2, 4] and not section_complete:  # Steps 2 and 4: Turn 90 degrees
                 turn_speed = -pi/2 if square_idx == 2 else pi/2  # turn left for state 2, right for state 4
-                my_velocity_setpoint.put(0)      # No forward motion
-                my_yaw_setpoint.put(turn_speed)  # Set yaw rate
+                my_setpoint.put_fields(0, turn_speed) # No forward motion, set yaw rate
                 my_control_flag.put(1)           # Start turn
                 if position > turn_90:           # Condition to finish turn
                     my_control_flag.put(0)
                     square_idx += 1
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     section_complete = True
             
             elif square_idx == 3 and not section_complete:  # Steps 3: Drive forward short distance
-                my_velocity_setpoint.put(V)  # Forward velocity
-                my_yaw_setpoint.put(0)       # No yaw change
+                my_setpoint.put_fields(V, 0) # Forward velocity, no yaw change
                 my_control_flag.put(1)       # Start forward motion
                 if position > drive_3 * 3:   # Condition to finish drive
                     my_control_flag.put(0)
                     square_idx += 1
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     section_complete = True
             
             elif square_idx == 5 and not section_complete:  # Step 5: Drive forward longer distance
-                my_velocity_setpoint.put(V)  # Forward velocity
-                my_yaw_setpoint.put(0)       # No yaw change
+                my_setpoint.put_fields(V, 0) # Forward velocity, no yaw change
                 my_control_flag.put(1)       # Start forward motion
                 if position > drive_3 * 6:   # Condition to finish drive
                     my_control_flag.put(0)
                     square_idx += 1
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     section_complete = True
                     
             elif square_idx == 6 and not section_complete:  # Step 6: Turn slightly less than 90 degrees
-                my_velocity_setpoint.put(0)  # No forward motion
-                my_yaw_setpoint.put(pi/2)    # Set yaw rate
+                my_setpoint.put_fields(0, pi/2) # No forward motion, set yaw rate
                 my_control_flag.put(1)       # Start turn
                 if position > turn_90 * .65: # Condition to finish turn
                     my_control_flag.put(0)
                     square_idx += 1
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     section_complete = True
                     
             elif square_idx == 7 and not section_complete:  # Step 7: Drive forward until the line has been reached
-                my_velocity_setpoint.put(V)  # Forward velocity
-                my_yaw_setpoint.put(0)       # No yaw change
+                my_setpoint.put_fields(V, 0) # Forward velocity, no yaw change
                 my_control_flag.put(1)       # Start forward motion
                 if position > drive_3 * 4:   # Condition to finish drive
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     square_idx = 0          # Reset for future operations
                     bump_detected = False   # reset the bump detection flag
                     after_wall = True       # raise obstacle cleared flag
+                    line_version = -1       # set the yaw from the next line reading
                     state = 1               # return to line following
 
             if section_complete:            # when a section has been completed
@@ -450,80 +548,165 @@ def driving_mode(shares):
             yield(state)
             
         elif state == 3:                          # Leave box state
-            enc_R.update()                        # Update encoder position
-            position = abs(enc_R.get_position())  # Get position magnitude
+            position = abs(my_position_R.get() - start_position) # Distance driven in this step
             if position > drive_3 * 2:            # After driving 3 inches
+                line_version = -1                 # set the yaw from the next line reading
                 state = 1                         # Set to line follow state
             yield(state)
             
         elif state == 4:                         # head back state
-            enc_R.update()                       # Update encoder position
-            position = abs(enc_R.get_position()) # Get position magnitude
+            position = abs(my_position_R.get() - start_position) # Distance driven in this step
             
             
             if return_idx == 1:                  # Step 1: drive forward
                 my_control_flag.put(1)           # Start movement
                 if position > drive_3 *2:        # After driving correct distance
-                    my_velocity_setpoint.put(0)  # Set velocity
-                    my_yaw_setpoint.put(pi/4)    # Set yaw
+                    my_setpoint.put_fields(0, pi/4) # Set velocity and yaw
                     my_control_flag.put(0)       # Turn off control
                     return_idx += 1              # increment index
-                    enc_R.zero()                 # Clear encoder position
+                    start_position = my_position_R.get() # measure distance from here
     
             elif return_idx == 2:                # Step 2: adjust heading
                 my_control_flag.put(1)           # Start movement
-                IMU.read_euler()
-                if IMU.euler_heading > (starting_heading - 1):    # After driving correct distance
-                    my_velocity_setpoint.put(-V) # Set reverse velocity
-                    my_yaw_setpoint.put(0)       # No yaw change
+                if heading_error(my_heading.get(), starting_heading) > -1: # After reaching the starting heading
+                    my_setpoint.put_fields(-V, 0) # Set reverse velocity, no yaw change
                     my_control_flag.put(0)       # Turn off control
                     return_idx += 1              # increment index
-                    enc_R.zero()                 # Clear encoder position
+                    start_position = my_position_R.get() # measure distance from here
     
             else:                                # Step 3: drive backwards
                 my_control_flag.put(1)           # Start movement
                 if position > drive_3 *3:        # After driving correct distance
                     
                     return_idx = 1
-                    enc_R.zero()
+                    start_position = my_position_R.get()
                     state = 5
             yield(state)
 
 
         # Note: States 5 - 7 could have been implemented as a single state, but this seemed a little easier at the time
         elif state == 5:                # watch for line state
-            qtr.read_line()             # read the line sensor
-            if qtr.full_black == True:  # if there is a horizontal black line, the start box has been located
-                enc_R.zero()            # zero encoder
+            feature = my_line_feature.get()
+            if feature == feat_crossing or feature == feat_finish: # if there is a horizontal black line, the start box has been located
+                start_position = my_position_R.get() # measure distance from here
                 state = 6               # enter state 6
             yield(state)
             
         elif state == 6:                          # drive into box state
-            enc_R.update()                        # Update encoder position
-            position = abs(enc_R.get_position())  # Current position magnitude
+            position = abs(my_position_R.get() - start_position) # Distance driven in this step
             if position > drive_3 *1.5:           # drive 4.5 inches
-                my_velocity_setpoint.put(0)       # set velocity to zero
-                my_yaw_setpoint.put(pi/2)         # Set yaw for turn around
+                my_setpoint.put_fields(0, pi/2)   # set velocity to zero, set yaw for turn around
                 my_control_flag.put(0)            # turn off control so the robot stops before turning
-                enc_R.zero()                      # zero encoder
+                start_position = my_position_R.get() # measure distance from here
                 state = 7                         # enter state 7
             yield(state)
               
         elif state == 7:                          # turn in place state
             my_control_flag.put(1)                # enable robot control
-            enc_R.update()                        # Update encoder position
-            position = abs(enc_R.get_position())  # Current position magnitude
+            position = abs(my_position_R.get() - start_position) # Distance driven in this step
             if position > turn_90*2:              # Condition to finish turn
                 my_control_flag.put(0)            # once turn has been completed, turn off control
-                enc_R.zero()                      # zero encoder
+                start_position = my_position_R.get() # measure distance from here
                 state = 0                         # enter init state
             yield(state)
             
         else:                   # if state isnt found
             raise ValueError('Invalid state')
 
+def create_tasks(motor_timer):
+    """!
+    Creates the shares and tasks which run the robot and adds the tasks to the cotask task list. The tasks use the
+    hardware objects mot_L, mot_R, enc_L, enc_R, IMU, heading_est, qtr and features, and the flags and times set in
+    the main program, as module globals, so those must be made first, as the main program does on the robot and
+    sim_sched.py does with stand-ins on a PC.
+    @param motor_timer timer which releases the motor control tasks every 2 ms, such as a pyb.Timer or a cotask.SimTimer
+    @return The group of motor control tasks
+    """
+    global task2, task5, bump_task # list global variables
+    
+    # create shares and queues for safely using variables in different tasks
+    setpoint = task_share.SharedBlock('f', ('velocity', 'yaw'), name="setpoint") # velocity and yaw rate setpoints, written together
+    omega_L_setpoint = task_share.Share('f', thread_protect=False, name="omega_L_setpoint")
+    omega_R_setpoint = task_share.Share('f', thread_protect=False, name="omega_R_setpoint")
+    omega_L_actual = task_share.Share('f', thread_protect=False, name="omega_L_actual")
+    omega_R_actual = task_share.Share('f', thread_protect=False, name="omega_R_actual")
+    control_flag = task_share.Share('f', thread_protect=False, name="control_flag")
+    calibration_flag = task_share.Share('f', thread_protect=False, name='calibration_flag')
+    line_reading = task_share.Share('f', thread_protect=False, name="line_reading")
+    line_feature = task_share.Share('B', thread_protect=False, name="line_feature")
+    yaw_rate = task_share.Share('f', thread_protect=False, name="yaw_rate")
+    heading = task_share.Share('f', thread_protect=False, name="heading")
+    imu_time = task_share.Share('L', thread_protect=False, name="imu_time")
+    position_R = task_share.Share('l', thread_protect=False, name="position_R") # right wheel position [encoder counts]
+
+    # Create the tasks. If trace is enabled for any task, a fixed buffer holding its most recent state transitions is allocated when the task is
+    # created, so tracing can be left on for a whole run. Dump the traces with dump_trace() after the run to read them on a PC
+    
+    # If the program does not seem to be running, try adjusting priorities and periods
+    
+    task1 = cotask.Task(planner, name="Task_1", priority=4, period=150,
+                        profile=True, trace=False, shares=(setpoint, control_flag, calibration_flag))
+    
+    task2 = cotask.Task(robot_control, name="Task_2", priority=1, period=5,
+                        profile=True, trace=False, shares=(setpoint, control_flag, omega_L_setpoint, omega_R_setpoint,
+                                                           omega_L_actual, omega_R_actual, yaw_rate, imu_time))
+    
+    # The motor control tasks run back to back as one group, released every 2 ms by the motor timer rather than by polling
+    # the clock, so both encoders are read at nearly the same time and the scheduler checks one task instead of two. The
+    # group is run from micropython.schedule(), part way through whatever task is running, so its release jitter is
+    # not set by the other tasks' run times. Only the motor tasks use the motors and encoders, and each share they use
+    # is read or written whole, so the only mismatch possible is that robot control puts one wheel setpoint before a
+    # group run and the other after it, which leaves the wheels on setpoints from different robot control runs for 2 ms
+    task3 = cotask.Task(motor_L_control, name="Task_3", priority=1,
+                        profile=True, trace=False, shares=(omega_L_setpoint, omega_L_actual, control_flag))
+    
+    task4 = cotask.Task(motor_R_control, name="Task_4", priority=1,
+                        profile=True, trace=False, shares=(omega_R_setpoint, omega_R_actual, control_flag, position_R)) 
+    
+    motors = cotask.TimerTaskGroup((task3, task4), motor_timer, name="Motors", priority=1, profile=True,
+                                   mode='schedule')
+    
+    task5 = cotask.Task(driving_mode, name="Task_5", priority=3, period=25,
+                        profile=True, trace=False, shares=(setpoint, control_flag, calibration_flag,
+                                                           line_reading, line_feature, heading, position_R)) 
+    
+    # The sensing tasks skip any releases they miss rather than running back to back to catch up, since a burst of
+    # readings taken at once is no better than one and would hold up the other tasks
+    task6 = cotask.Task(line_sensing, name="Task_6", priority=2, period=0.5,
+                        profile=True, trace=False, shares=(line_reading, line_feature), overrun='skip')
+    
+    task7 = cotask.Task(imu_sampling, name="Task_7", priority=2, period=5,
+                        profile=True, trace=False, shares=(yaw_rate, heading, imu_time), overrun='skip')
+    
+    cotask.task_list.append(task1)
+    cotask.task_list.append(task2)
+    cotask.task_list.append(motors)
+    cotask.task_list.append(task5)
+    cotask.task_list.append(task6)
+    cotask.task_list.append(task7)
+
+    # The robot control and driving mode tasks sleep while the robot is stopped, so they are woken when a flag they
+    # wait on changes and when a bump is detected. The driving mode task's own writes to the control flag, which stop
+    # the robot between the steps of its path around the obstacle, don't wake it, so each stop lasts a full period
+    control_flag.subscribe(task2)
+    control_flag.subscribe(task5)
+    calibration_flag.subscribe(task5)
+    bump_task = task5
+    return motors
+
 if __name__ == "__main__":
     
+    # Import the hardware drivers
+    from pyb import Pin, Timer, UART, repl_uart, ExtInt
+    import machine
+    import micropython
+    from encoder import encoder
+    from Romi_Motor import Romi_Motor
+    from line_sensor import line_sensor
+    
+    boot_time = ticks_us() # used to report how long the IMU takes to be ready
+    micropython.alloc_emergency_exception_buf(100) # allow errors in timer interrupts to be reported
+    
     # configure UART to communicate with Romi using bluetooth
     uart = UART(3, baudrate=115200)
     repl_uart(uart)
@@ -550,6 +733,8 @@ if __name__ == "__main__":
     
     # setup left and right bumper interrupts
     bump_detected = False
+    bump_task = None
+    imu_age_max = 0 # oldest IMU sample used by the robot control task [us]
     left_int = ExtInt(Pin.cpu.B14, ExtInt.IRQ_FALLING, Pin.PULL_UP, bump_toggle)
     right_int = ExtInt(Pin.cpu.C7, ExtInt.IRQ_FALLING,Pin.PULL_UP, bump_toggle)
     
@@ -557,56 +742,36 @@ if __name__ == "__main__":
     i2c1 = machine.I2C(1)    # create I2C object on bus 1
     IMU = BNO055(i2c1)       # create BNO055 object using I2C bus
     IMU.set_opr_mode('ndof') # set IMU operating mode
+    heading_est = heading_estimator() # create estimator integrating yaw rate between heading reads
     
     # set up line sensor alternating from left to right
     sensor_pins = [Pin.cpu.C0, Pin.cpu.A6, Pin.cpu.C1, Pin.cpu.A7, 
                    Pin.cpu.B0, Pin.cpu.B1, Pin.cpu.A4, Pin.cpu.C3]
-    qtr = line_sensor(sensor_pins) # create line_sensor object
-
-    # create shares and queues for safely using variables in different tasks
-    velocity_setpoint = task_share.Share('f', thread_protect=False, name="velocity_setpoint")
-    yaw_setpoint = task_share.Share('f', thread_protect=False, name="yaw_setpoint")
-    omega_L_setpoint = task_share.Share('f', thread_protect=False, name="omega_L_setpoint")
-    omega_R_setpoint = task_share.Share('f', thread_protect=False, name="omega_R_setpoint")
-    omega_L_actual = task_share.Share('f', thread_protect=False, name="omega_L_actual")
-    omega_R_actual = task_share.Share('f', thread_protect=False, name="omega_R_actual")
-    control_flag = task_share.Share('f', thread_protect=False, name="control_flag")
-    calibration_flag = task_share.Share('f', thread_protect=False, name='calibration_flag')
-    line_reading = task_share.Share('f', thread_protect=False, name="line_reading")
+    qtr = line_sensor(sensor_pins, adaptive=True) # create line_sensor object, ending reads at the black bound
+    if not qtr.load_calibration(): # load the per-channel bounds saved by line_sensor.py
+        print('No usable line sensor calibration found, using uncalibrated readings')
+    features = line_features()     # create history of line readings for finding course features
 
-    # Create the tasks. If trace is enabled for any task, memory will be allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for  debugging and set trace to False when it's not needed
-    
-    # If the program does not seem to be running, try adjusting priorities and periods
-    
-    task1 = cotask.Task(planner, name="Task_1", priority=4, period=150,
-                        profile=True, trace=False, shares=(velocity_setpoint, yaw_setpoint, control_flag, calibration_flag))
-    
-    task2 = cotask.Task(robot_control, name="Task_2", priority=1, period=5,
-                        profile=True, trace=False, shares=(velocity_setpoint, yaw_setpoint, control_flag, omega_L_setpoint, omega_R_setpoint,
-                                                           omega_L_actual, omega_R_actual))
-    
-    task3 = cotask.Task(motor_L_control, name="Task_3", priority=1, period=2,
-                        profile=True, trace=False, shares=(omega_L_setpoint, omega_L_actual, control_flag))
-    
-    task4 = cotask.Task(motor_R_control, name="Task_4", priority=1, period=2,
-                        profile=True, trace=False, shares=(omega_R_setpoint, omega_R_actual, control_flag)) 
-    
-    task5 = cotask.Task(driving_mode, name="Task_5", priority=3, period=25,
-                        profile=True, trace=False, shares=(velocity_setpoint, yaw_setpoint, control_flag, calibration_flag)) 
-    
-    cotask.task_list.append(task1)
-    cotask.task_list.append(task2)
-    cotask.task_list.append(task3)
-    cotask.task_list.append(task4)
-    cotask.task_list.append(task5)
+    motors = create_tasks(Timer(6, freq=500)) # the motor control tasks are released by timer 6
 
     # Run the memory garbage collector to ensure memory is as defragmented as possible before the real-time scheduler is started
     gc.collect()
 
-    # Run the scheduler with the chosen scheduling algorithm. Quit if ^C pressed
+    # Run the scheduler with the chosen scheduling algorithm, sleeping until the next task is due
+    # whenever nothing is ready. Quit if ^C pressed and show the task profiles and CPU utilization
     while True:
         try:
-            cotask.task_list.pri_sched()
+            if not cotask.task_list.pri_sched():
+                cotask.task_list.idle()
         except KeyboardInterrupt:
             break
+    print(cotask.task_list)
+    print(cotask.task_list.percentiles())
+    print(motors.get_release_stats())
+    print(f"Oldest IMU sample used by robot control {imu_age_max/1000:.3f} ms")
+
+    # Check whether the slowest runs measured during this run would let every task meet its deadline
+    try:
+        print(sched_analysis.report(cotask.task_list))
+    except ValueError as err:
+        print(f"No schedulability report: {err}")
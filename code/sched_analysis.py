@@ -0,0 +1,216 @@
+"""!
+@file sched_analysis.py
+@brief Schedulability analysis of a cotask task list from its profiled run times.
+@details Takes the worst case run time (WCET) of each task from its profile, or from a
+         dictionary of estimates, along with its period and priority, and finds whether
+         every task is guaranteed to finish before its next release. Since cotask tasks
+         are never preempted, a task which starts running holds up every other task until
+         it yields, so the analysis is the non-preemptive form: each task may be blocked
+         by the longest run of a task it cannot preempt as well as delayed by the tasks
+         which run ahead of it.
+
+         Three schedules are checked. The fixed priority analysis uses the priorities set
+         in the task list, as pri_sched() does, and finds the worst case response time of
+         each task over its level-i busy period. The rate monotonic analysis does the same
+         with priorities given by period, shortest period highest. The EDF analysis checks
+         the processor demand at every deadline in the synchronous busy period, as run by
+         deadline_sched(). Each task's deadline is its period. Tasks with no period are
+         treated as blocking only, since how often they run is not known. A timer released
+         task run from micropython.schedule() is the exception to non-preemption: it runs
+         part way through other tasks, so it is given a priority above them all, is never
+         blocked by them and never blocks them.
+
+Functions:
+    - task_params: Gets the run times, periods and priorities of the tasks in a task list.
+    - fixed_priority: Response time analysis for non-preemptive fixed priority scheduling.
+    - edf: Processor demand analysis for non-preemptive earliest deadline first scheduling.
+    - report: Makes a printable report of all three analyses.
+
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import cotask
+
+# longest response time searched for, as a multiple of the task's period
+max_periods = 1000
+
+# priority given to tasks run from micropython.schedule(), which preempt every other task
+preemptive = 1 << 30
+
+def ceil_div(a, b):
+    '''!@brief Divides two positive integers, rounding up.
+    '''
+    return -(-a // b)
+
+def task_params(task_list=cotask.task_list, wcet=None):
+    '''!@brief Gets the run times, periods and priorities of the tasks in a task list.
+    @param task_list the cotask.TaskList to analyze
+    @param wcet dictionary of worst case run times [us] keyed by task name, used in place
+           of the profiled longest run time for the tasks it names
+    @return A list of (name, run time [us], period [us], priority) for the timed tasks,
+            and a list of (name, run time [us]) for the tasks with no period. Tasks run
+            from micropython.schedule() have the priority preemptive.
+    @raise ValueError if the run time of a task is not known
+    '''
+    timed = []
+    untimed = []
+    for pri in task_list.pri_list:
+        for task in pri[2:]:
+            run_us = wcet.get(task.name) if wcet else None
+            if run_us is None:
+                run_us = task._slowest
+            if run_us <= 0:
+                raise ValueError(f"Run time of {task.name} is not known")
+            if task.period is None:
+                untimed.append((task.name, run_us))
+            elif getattr(task, '_scheduled', False):
+                timed.append((task.name, run_us, task.period, preemptive))
+            else:
+                timed.append((task.name, run_us, task.period, task.priority))
+    return timed, untimed
+
+def fixed_priority(timed, untimed=(), rate_monotonic=False):
+    '''!@brief Finds worst case response times under non-preemptive fixed priority scheduling.
+    @details Tasks with the same priority as a task are counted as running ahead of it,
+             since the round-robin order within a priority can put any of them first.
+             A task is blocked by the longest run of a lower priority task or a task
+             with no period, since one of those may have just started when it is released.
+    @param timed list of (name, run time [us], period [us], priority) from task_params()
+    @param untimed list of (name, run time [us]) for tasks with no period
+    @param rate_monotonic True to give shorter period tasks higher priority in place of
+           the priorities in the task list
+    @return A list of (name, run time, period, response time, slack, guaranteed, blocker)
+            in order of priority, with times in microseconds. The response time and slack
+            are None if the response time has no bound.
+    '''
+    if rate_monotonic:
+        timed = [(name, run_us, period, priority if priority >= preemptive else -period)
+                 for name, run_us, period, priority in timed]
+    timed = sorted(timed, key=lambda task: task[3], reverse=True)
+
+    results = []
+    for name, run_us, period, priority in timed:
+        ahead = [(other[1], other[2]) for other in timed
+                 if other[3] >= priority and other[0] != name]
+        blockers = [(other[1], other[0]) for other in timed if other[3] < priority]
+        blockers += [(other[1], other[0]) for other in untimed]
+        if priority >= preemptive:
+            blockers = []
+        block_us, blocker = max(blockers) if blockers else (0, None)
+
+        response = _response_time(run_us, period, ahead, block_us)
+        if response is None:
+            results.append((name, run_us, period, None, None, False, blocker))
+        else:
+            results.append((name, run_us, period, response, period - response,
+                            response <= period, blocker))
+    return results
+
+def _response_time(run_us, period, ahead, block_us):
+    '''!@brief Finds the worst case response time of one task over its level-i busy period.
+    @param run_us run time of the task [us]
+    @param period period of the task [us]
+    @param ahead list of (run time, period) of the tasks which run ahead of it [us]
+    @param block_us longest time the task can be blocked [us]
+    @return The worst case response time [us], or None if it has no bound
+    '''
+    limit = max_periods*period
+    if sum(c / t for c, t in ahead) + run_us / period >= 1:
+        return None
+
+    # the busy period is as long as the work released during it
+    busy = block_us + run_us
+    while True:
+        new_busy = block_us + ceil_div(busy, period)*run_us
+        new_busy += sum(ceil_div(busy, t)*c for c, t in ahead)
+        if new_busy == busy:
+            break
+        busy = new_busy
+
+    # check every job of the task released in the busy period
+    worst = 0
+    for job in range(ceil_div(busy, period)):
+        start = block_us + job*run_us
+        while True:
+            new_start = block_us + job*run_us + sum((start // t + 1)*c for c, t in ahead)
+            if new_start == start:
+                break
+            start = new_start
+            if start > limit:
+                return None
+        worst = max(worst, start + run_us - job*period)
+    return worst
+
+def edf(timed, untimed=()):
+    '''!@brief Checks non-preemptive earliest deadline first scheduling by processor demand.
+    @details At each deadline t in the synchronous busy period, the run time of every job
+             with its deadline at or before t, plus the longest run of a task whose
+             deadline is after t, must fit in t. The slack of a task is the least time to
+             spare at any of its own deadlines. Preemptive tasks add to the demand but
+             neither block nor are blocked.
+    @param timed list of (name, run time [us], period [us], priority) from task_params()
+    @param untimed list of (name, run time [us]) for tasks with no period
+    @return A list of (name, run time, period, slack, guaranteed, blocker) in order of
+            period, with times in microseconds. The slack is None if the tasks need all
+            of the CPU.
+    '''
+    timed = sorted(timed, key=lambda task: task[2])
+    if sum(run_us / period for _, run_us, period, _ in timed) >= 1:
+        return [(name, run_us, period, None, False, None) for name, run_us, period, _ in timed]
+
+    longest = max([run_us for _, run_us, _, _ in timed] + [run_us for _, run_us in untimed])
+    busy = longest
+    while True:
+        new_busy = longest + sum(ceil_div(busy, period)*run_us for _, run_us, period, _ in timed)
+        if new_busy == busy:
+            break
+        busy = new_busy
+
+    results = []
+    for name, run_us, period, priority in timed:
+        slack = None
+        blocker = None
+        for deadline in range(period, max(busy, period) + 1, period):
+            demand = sum((deadline // t)*c for _, c, t, _ in timed if t <= deadline)
+            blockers = [(c, other) for other, c, t, p in timed if t > deadline and p < preemptive]
+            blockers += [(c, other) for other, c in untimed]
+            if priority >= preemptive:
+                blockers = []
+            block_us, block_name = max(blockers) if blockers else (0, None)
+            spare = deadline - demand - block_us
+            if slack is None or spare < slack:
+                slack = spare
+                blocker = block_name
+        results.append((name, run_us, period, slack, slack >= 0, blocker))
+    return results
+
+def report(task_list=cotask.task_list, wcet=None):
+    '''!@brief Makes a printable report of the fixed priority, rate monotonic and EDF analyses.
+    @param task_list the cotask.TaskList to analyze
+    @param wcet dictionary of worst case run times [us] keyed by task name, used in place
+           of the profiled longest run time for the tasks it names
+    @return The report, with times in milliseconds
+    '''
+    timed, untimed = task_params(task_list, wcet)
+    util = sum(run_us / period for _, run_us, period, _ in timed)
+    text = f"Timed task CPU utilization {100*util:.1f}%\n"
+
+    for title, results in (("Fixed priority", fixed_priority(timed, untimed)),
+                           ("Rate monotonic", fixed_priority(timed, untimed, True))):
+        text += f"\n{title}\nTASK                 WCET    PERIOD  RESPONSE     SLACK  OK  BLOCKED BY\n"
+        for name, run_us, period, response, slack, ok, blocker in results:
+            text += f"{name:<16s}{run_us/1000: 9.3f}{period/1000: 10.3f}"
+            if response is None:
+                text += '         -         -'
+            else:
+                text += f"{response/1000: 10.3f}{slack/1000: 10.3f}"
+            text += f"  {'yes' if ok else 'NO ':<4s}{blocker or '-'}\n"
+
+    text += "\nEDF\nTASK                 WCET    PERIOD     SLACK  OK  BLOCKED BY\n"
+    for name, run_us, period, slack, ok, blocker in edf(timed, untimed):
+        text += f"{name:<16s}{run_us/1000: 9.3f}{period/1000: 10.3f}"
+        text += '         -' if slack is None else f"{slack/1000: 10.3f}"
+        text += f"  {'yes' if ok else 'NO ':<4s}{blocker or '-'}\n"
+    return text
@@ -0,0 +1,301 @@
+"""!
+@file sim_sched.py
+@brief Runs main.py's task set on a virtual clock, faster than real time.
+@details Builds the shares and tasks with main.create_tasks(), the same function the robot uses,
+         so the tasks run main.py's own code with its names, priorities, periods, overrun
+         policies and shares. The hardware is replaced by stand-ins: motors which hold their
+         duty cycle, encoders which count as a wheel driven at that duty would, an IMU which
+         reads zero and has a saved calibration, and a line sensor which sees a line under
+         its middle and takes three slices to finish a read. The tasks read the time from the
+         virtual clock, and each run moves the clock forward by a typical run time for that
+         task, so the schedule is the same as on the robot but no hardware is needed. The
+         motor control group is released by a simulated 2 ms timer and run from
+         micropython.schedule(), part way through the task it interrupts, as on the robot.
+         The blue button is taken as pressed, so the robot calibrates, leaves the box and
+         follows the line. The task set is run twice to show the schedule is the same
+         every time, then the task table and the ratio of virtual to real time are printed.
+         Finally it is run by the cyclic executive with a dispatch table built from the
+         typical run times. The 0.5 ms line sensing task leaves too little of each 0.5 ms
+         frame for the motor group, so that table is refused and the task set is run
+         without it, on the 2, 5, 25 and 150 ms periods alone. Last, the stop
+         between the steps of the path around an obstacle is timed, to check that the
+         driving mode task is not woken by its own write to the control flag. Run it
+         with CPython or MicroPython's Unix port; cotask and task_share use the stand-ins
+         in host_compat.py for the MicroPython modules which are missing.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+# import modules
+import gc
+from array import array
+import cotask
+import task_share
+import main
+from ticks_compat import ticks_ms, ticks_diff
+from line_features import line_features
+from heading_estimator import heading_estimator
+
+sim_ms = 10_000     # virtual time each run covers [ms]
+
+# typical run time [us] of each of main.py's tasks, by name
+run_times = {"Task_1": 300, "Task_2": 400, "Task_3": 250, "Task_4": 250,
+             "Task_5": 300, "Task_6": 50, "Task_7": 250}
+
+class SimMotor:
+    '''!@brief A stand-in for a Romi_Motor which holds its duty cycle.
+    '''
+    def __init__(self):
+        self.duty = 0
+        self.enabled = False
+
+    def set_duty(self, duty):
+        self.duty = max(-100, min(100, duty))
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+class SimEncoder:
+    '''!@brief A stand-in for an encoder on a wheel driven by a SimMotor.
+    @details The wheel speeds up or slows down toward a speed in proportion to the motor's
+             duty cycle with a first order lag, and the counts run backwards for forward
+             motion, as those of the robot's encoders do.
+    '''
+    def __init__(self, motor, sim_clock, max_omega=20, lag_us=50_000):
+        '''!@brief Makes an encoder stand-in.
+        @param motor the SimMotor which drives the wheel
+        @param sim_clock the virtual clock
+        @param max_omega wheel speed at full duty cycle [rad/s]
+        @param lag_us time constant of the wheel's response to the duty cycle [us]
+        '''
+        self.motor = motor
+        self.sim_clock = sim_clock
+        self.max_omega = max_omega
+        self.lag_us = lag_us
+        self.omega = 0.0
+        self.time_old = sim_clock.ticks_us()
+        self.count = 0.0
+        self.delta = 0
+        self.dt = 0
+        self.speed = 0
+
+    def update(self):
+        time_new = self.sim_clock.ticks_us()
+        self.dt = ticks_diff(time_new, self.time_old)
+        self.time_old = time_new
+        target = self.max_omega*self.motor.duty/100 if self.motor.enabled else 0
+        self.omega += (target - self.omega)*min(1, self.dt/self.lag_us)
+        count_new = self.count - self.omega*self.dt/4363 # 4363 is main.py's count/us to rad/s factor
+        self.delta = int(count_new) - int(self.count)
+        self.count = count_new
+        self.speed = self.delta/self.dt if self.dt > 0 else 0
+
+    def get_position(self):
+        return int(self.count)
+
+    def get_delta(self):
+        return self.delta
+
+    def get_speed(self):
+        return self.speed
+
+    def get_dt(self):
+        return self.dt
+
+    def zero(self):
+        self.count = 0.0
+
+class SimIMU:
+    '''!@brief A stand-in for a BNO055 which is calibrated and reads a robot holding still.
+    '''
+    def __init__(self):
+        self.gyr = array('h', [0]*3)
+        self.euler = array('h', [0]*3)
+        self.mag_cal_status = self.acc_cal_status = self.gyr_cal_status = self.sys_cal_status = 3
+
+    def read_gyr(self):
+        pass
+
+    def read_gyr_euler(self):
+        pass
+
+    def read_cal_status(self):
+        pass
+
+    def load_profile(self, name='default'):
+        pass
+
+    def convert_legacy(self, name='default'):
+        return False
+
+    def save_profile(self, name='default'):
+        pass
+
+class SimLineSensor:
+    '''!@brief A stand-in for a line_sensor which sees a line under its middle.
+    '''
+    def __init__(self, slices=3):
+        '''!@brief Makes a line sensor stand-in.
+        @param slices number of calls to poll() which finish a read
+        '''
+        self.slices = slices
+        self.left = 0
+        self.reading = 0
+        self.intensity = 4000
+        self.full_black = False
+
+    def start_read(self):
+        self.left = self.slices
+
+    def poll(self, budget):
+        self.left -= 1
+        return self.left <= 0
+
+def quiet(*args, **kwargs):
+    '''!@brief Takes the place of print() in main.py so the tasks' messages are not shown.
+    '''
+    pass
+
+def timed_run(gen, sim_clock, run_us):
+    '''!@brief Runs a task's generator, moving the virtual clock forward by its run time each run.
+    @param gen the task's generator
+    @param sim_clock the virtual clock
+    @param run_us typical run time of the task [us]
+    '''
+    while True:
+        state = next(gen)
+        sim_clock.advance(run_us)
+        yield state
+
+def build(sim_clock):
+    '''!@brief Gives main.py stand-in hardware and builds its task set with main.create_tasks().
+    @param sim_clock the virtual clock, which must already be set in cotask
+    @return The task list holding main.py's tasks
+    '''
+    main.mot_L = SimMotor()
+    main.mot_R = SimMotor()
+    main.enc_L = SimEncoder(main.mot_L, sim_clock)
+    main.enc_R = SimEncoder(main.mot_R, sim_clock)
+    main.IMU = SimIMU()
+    main.heading_est = heading_estimator()
+    main.qtr = SimLineSensor()
+    main.features = line_features()
+    main.list_profiles = lambda: ['default']
+    main.ticks_us = sim_clock.ticks_us
+    main.print = quiet
+    main.boot_time = sim_clock.ticks_us()
+    main.user_button_pressed = True
+    main.bump_detected = False
+    main.bump_task = None
+    main.imu_age_max = 0
+
+    cotask.task_list = cotask.TaskList()
+    main.create_tasks(cotask.SimTimer(500))
+    for task in cotask.task_list._all_tasks():
+        if task.name in run_times:
+            task._run_gen = timed_run(task._run_gen, sim_clock, run_times[task.name])
+    return cotask.task_list
+
+def run(cyclic=False, leave_out=()):
+    '''!@brief Runs main.py's task set for sim_ms of virtual time on a new virtual clock.
+    @param cyclic True to run the tasks with the cyclic executive instead of pri_sched()
+    @param leave_out names of tasks to leave out of the task set
+    @return The task list, the number of runs of each task, and the real time taken [ms]
+    '''
+    sim_clock = cotask.VirtualClock()
+    cotask.set_clock(sim_clock)
+    cotask.sim_timers.clear()
+
+    built = build(sim_clock)
+    task_list = cotask.TaskList()
+    for pri in built.pri_list:
+        for task in pri[2:]:
+            if task.name not in leave_out:
+                task_list.append(task)
+    task_list.reset_utilization()
+
+    sched = task_list.pri_sched
+    if cyclic:
+        wcet = dict(run_times)
+        wcet["Motors"] = run_times["Task_3"] + run_times["Task_4"]
+        task_list.build_cyclic(wcet)
+        sched = task_list.cyclic_sched
+
+    gc.collect()
+    time_start = ticks_ms()
+    while sim_clock.ticks_ms() < sim_ms:
+        if not sched():
+            task_list.idle()
+    real_ms = ticks_diff(ticks_ms(), time_start)
+
+    runs = [task._runs for task in task_list._all_tasks()]
+    return task_list, runs, real_ms
+
+def flag_writer(shares):
+    '''!@brief Lowers a flag for one run and raises it at the next, as driving_mode does to stop.
+    @param shares tuple holding the flag
+    '''
+    flag, = shares
+    while True:
+        flag.put(0)
+        yield 0
+        flag.put(1)
+        yield 1
+
+def flag_watcher(shares):
+    '''!@brief Records the time of every change in a flag, as robot_control sees them.
+    @param shares tuple holding the virtual clock, the flag and the list of changes
+    '''
+    sim_clock, flag, changes = shares
+    while True:
+        changes.append((sim_clock.ticks_us(), flag.get()))
+        yield 0
+
+def stop_time():
+    '''!@brief Times how long a flag lowered by a 25 ms task which is subscribed to it stays low.
+    @details The writer is subscribed to the flag, as driving_mode is to the control flag
+             while it waits to start. A write by a subscribed task must not release that
+             task, or it would raise the flag again at the next scheduler pass.
+    @return The time the flag was low [ms]
+    '''
+    sim_clock = cotask.VirtualClock()
+    cotask.set_clock(sim_clock)
+    flag = task_share.Share('B', thread_protect=False, name="flag")
+    flag.put(1)
+    changes = []
+    task_list = cotask.TaskList()
+    writer = cotask.Task(flag_writer, name="Writer", priority=3, period=25, shares=(flag,))
+    watcher = cotask.Task(flag_watcher, name="Watcher", priority=1,
+                          shares=(sim_clock, flag, changes))
+    task_list.append(writer)
+    task_list.append(watcher)
+    flag.subscribe(writer)
+    flag.subscribe(watcher)
+
+    while sim_clock.ticks_ms() < 100:
+        if not task_list.pri_sched():
+            task_list.idle()
+    cotask.set_clock(cotask.utime)
+
+    low = [time_us for time_us, value in changes if value == 0]
+    high = [time_us for time_us, value in changes if value == 1 and low and time_us > low[0]]
+    return (high[0] - low[0]) / 1000
+
+if __name__ == '__main__':
+    first, first_runs, _ = run()
+    task_list, runs, real_ms = run()
+    print(task_list)
+    print(f"{sim_ms} ms simulated in {real_ms} ms, {sim_ms / max(real_ms, 1):.1f} times real time")
+    print('runs match between passes' if runs == first_runs else 'runs differ between passes')
+    print()
+    try:
+        run(cyclic=True)
+    except ValueError as err:
+        print(f"Cyclic schedule refused: {err}")
+        task_list, runs, real_ms = run(cyclic=True, leave_out=("Task_6",))
+        print(task_list)
+    cotask.set_clock(cotask.utime)
+    print(f"Control flag held low for {stop_time():.1f} ms by a 25 ms task")
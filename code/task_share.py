@@ -23,14 +23,29 @@
 
 import array
 import gc
-import pyb
-import micropython
+import sys
+try:
+    import pyb
+    import utime
+    import micropython
+except ImportError:
+    # On a PC, stand-ins are used for the modules which are missing
+    from host_compat import pyb, utime, micropython
 
 
 ## This is a system-wide list of all the queues and shared variables. It is
 #  used to create diagnostic printouts. 
 share_list = []
 
+## Find the task which the scheduler is running, if any. The scheduler is 
+#  found among the loaded modules rather than imported, so shares and 
+#  queues can be used in programs which don't use it.
+#  @return The running @c cotask.Task, or @c None if no task is running
+def _running_task ():
+    cotask = sys.modules.get ('cotask')
+    return cotask.current_task if cotask else None
+
+
 ## This dictionary allows readable printouts of queue and share data types.
 type_code_strings = {'b' : "int8",   'B' : "uint8",
                      'h' : "int16",  'H' : "uint16",
@@ -138,6 +153,9 @@ class Queue (BaseShare):
             self._buffer = None
             raise
 
+        # The task, if any, which is blocked in recv() waiting for data
+        self._waiter = None
+
         # Initialize pointers to be used for reading and writing data
         self.clear ()
 
@@ -196,6 +214,10 @@ class Queue (BaseShare):
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (_irq_state)
 
+        # Release a task blocked waiting for the data
+        if self._waiter is not None:
+            self._waiter.go ()
+
 
     ## Read an item from the queue.
     # 
@@ -242,6 +264,59 @@ class Queue (BaseShare):
         return (to_return)
 
 
+    ## Receive an item from the queue inside a task, letting other tasks run
+    #  while the queue is empty.
+    #
+    #  Unlike @c get(), which holds up every task until data arrives, this
+    #  is a generator which the task's generator runs with @c yield @c from.
+    #  If the queue is empty, the task is suspended with @c cotask.Task.block()
+    #  and yields; the scheduler skips it, checking only its go flag and the
+    #  end of the timeout, until @c put() releases it or the timeout passes.
+    #  The task's period and release statistics are left alone. If the 
+    #  queue has data, an item is returned at once without yielding.
+    #
+    #  Only a task blocked here is released by @c put(), so a task with no
+    #  period should go straight back to @c recv() after handling an item, 
+    #  as below, rather than yield; a task with a period may do either. 
+    #  Only one task at a time may wait on a queue, and tasks run as members
+    #  of a @c cotask.TaskGroup can't wait.
+    #  @code
+    #     def some_task (shares):
+    #         my_queue, = shares
+    #         while True:
+    #             something = yield from my_queue.recv (timeout_us = 50000)
+    #             if something is None:
+    #                 handle_timeout ()
+    #             else:
+    #                 do_something_with (something)
+    #  @endcode
+    #  @param timeout_us The longest time to wait in microseconds, or @c None
+    #         to wait as long as it takes
+    #  @param state The state the task yields while it waits, so that its
+    #         transition trace does not show a change of state
+    #  @return The item from the queue, or @c None if the timeout passed
+    #          before any data arrived
+    #  @raise RuntimeError if no task is running, as when called from 
+    #         outside the scheduler
+    def recv (self, timeout_us = None, state = 0):
+        if self.empty ():
+            task = _running_task ()
+            if task is None:
+                raise RuntimeError ('Queue.recv() must be run by a task')
+            self._waiter = task
+            task.block (timeout_us)
+            while True:
+                yield state
+                if not self.empty () or task.timed_out ():
+                    break
+            task.unblock ()
+            self._waiter = None
+            if self.empty ():
+                return None
+
+        return self.get ()
+
+
     ## Check if there are any items in the queue.
     # 
     #  Returns @c True if there are any items in the queue and @c False
@@ -299,6 +374,391 @@ class Queue (BaseShare):
                 type_code_strings[self._type_code], self._max_full, self._size))
 
 
+# ============================================================================
+
+## A queue for one producer and one consumer which needs no interrupt masking.
+#
+#  A @c Queue keeps a count of its items which both the writer and the reader
+#  change, so it needs interrupts disabled around each transfer when one side
+#  is an interrupt service routine. In this queue the write index is changed
+#  only by the producer and the read index only by the consumer; each side 
+#  stores its data before moving its own index, and one slot of the buffer is
+#  always left empty so that a full queue can be told apart from an empty 
+#  one. One ISR or task may put data and one task may get it with no 
+#  masking of interrupts. There must never be more than one producer or more
+#  than one consumer.
+#
+#  Items can be moved one at a time or in batches: @c put_many() copies from
+#  any sequence, and @c get_into() copies into a caller's @c array or 
+#  @c memoryview so that reading a batch allocates no memory. None of the 
+#  methods waits unless given a timeout, and a full queue is never 
+#  overwritten.
+#
+#  @code
+#  samples = task_share.SPSCQueue ('h', 64, name="Samples")
+#
+#  # In a timer ISR
+#  samples.put (adc.read ())
+#
+#  # In a task, read up to 16 samples at a time without allocating memory
+#  batch = array.array ('h', range (16))
+#  count = samples.get_into (batch)
+#  @endcode
+class SPSCQueue (BaseShare):
+
+    ## A counter used to give serial numbers to queues for diagnostic use.
+    ser_num = 0
+
+    ## Initialize a single producer, single consumer queue.
+    #  @param type_code The type of data items which the queue can hold, as
+    #         for a @c Queue
+    #  @param size The maximum number of items which the queue can hold
+    #  @param name A short name for the queue, default @c SPSCQueueN where
+    #         @c N is a serial number for the queue
+    def __init__ (self, type_code, size, name = None):
+        super ().__init__ (type_code, False, name)
+
+        self._size = size
+        self._slots = size + 1                 # One slot is always empty
+        self._name = str (name) if name != None \
+            else 'SPSCQueue' + str (SPSCQueue.ser_num)
+        SPSCQueue.ser_num += 1
+
+        self._buffer = array.array (type_code, range (self._slots))
+        self.clear ()
+        gc.collect ()
+
+
+    ## Put an item into the queue if there is room for it.
+    #  @param item The item to be placed into the queue
+    #  @return @c True if the item was put in, @c False if the queue was full
+    @micropython.native
+    def put (self, item):
+        wr_idx = self._wr_idx
+        next_idx = wr_idx + 1
+        if next_idx >= self._slots:
+            next_idx = 0
+        if next_idx == self._rd_idx:
+            return False
+        self._buffer[wr_idx] = item
+        self._wr_idx = next_idx
+        self._note_fill (next_idx)
+        return True
+
+
+    ## Put as many items as there is room for from a sequence.
+    #
+    #  If a timeout is given, wait up to that long for room for all the 
+    #  items before copying as many as fit. An ISR must not give a timeout.
+    #  @param items An @c array, @c memoryview, @c list or other sequence
+    #  @param timeout_us The longest time to wait for room in microseconds
+    #  @return The number of items put into the queue, from the start of
+    #          @c items
+    @micropython.native
+    def put_many (self, items, timeout_us = 0):
+        count = len (items)
+        if timeout_us and self._room () < count:
+            start = utime.ticks_us ()
+            while self._room () < count:
+                if utime.ticks_diff (utime.ticks_us (), start) >= timeout_us:
+                    break
+        room = self._room ()
+        if count > room:
+            count = room
+
+        # Copy into the buffer, wrapping around its end at most once
+        buf = self._buffer
+        slots = self._slots
+        wr_idx = self._wr_idx
+        for idx in range (count):
+            buf[wr_idx] = items[idx]
+            wr_idx += 1
+            if wr_idx >= slots:
+                wr_idx = 0
+        self._wr_idx = wr_idx
+        self._note_fill (wr_idx)
+        return count
+
+
+    ## Get an item from the queue.
+    #
+    #  If the queue is empty and a timeout is given, wait up to that long 
+    #  for an item to be put in.
+    #  @param timeout_us The longest time to wait in microseconds
+    #  @return The oldest item in the queue, or @c None if there was none
+    @micropython.native
+    def get (self, timeout_us = 0):
+        rd_idx = self._rd_idx
+        if rd_idx == self._wr_idx:
+            if not timeout_us:
+                return None
+            start = utime.ticks_us ()
+            while rd_idx == self._wr_idx:
+                if utime.ticks_diff (utime.ticks_us (), start) >= timeout_us:
+                    return None
+        item = self._buffer[rd_idx]
+        rd_idx += 1
+        if rd_idx >= self._slots:
+            rd_idx = 0
+        self._rd_idx = rd_idx
+        return item
+
+
+    ## Copy items from the queue into a buffer supplied by the caller.
+    #
+    #  As many items as are in the queue, up to the length of the buffer, are
+    #  copied to the start of the buffer. If a timeout is given, wait up to
+    #  that long for enough items to fill the buffer before copying.
+    #  @param buf An @c array or @c memoryview into which items are copied
+    #  @param timeout_us The longest time to wait in microseconds
+    #  @return The number of items copied into @c buf
+    @micropython.native
+    def get_into (self, buf, timeout_us = 0):
+        count = len (buf)
+        if timeout_us and self.num_in () < count:
+            start = utime.ticks_us ()
+            while self.num_in () < count:
+                if utime.ticks_diff (utime.ticks_us (), start) >= timeout_us:
+                    break
+        held = self.num_in ()
+        if count > held:
+            count = held
+
+        data = self._buffer
+        slots = self._slots
+        rd_idx = self._rd_idx
+        for idx in range (count):
+            buf[idx] = data[rd_idx]
+            rd_idx += 1
+            if rd_idx >= slots:
+                rd_idx = 0
+        self._rd_idx = rd_idx
+        return count
+
+
+    ## Check how many items are in the queue. The producer may add more or
+    #  the consumer remove some at any time, so this is a snapshot.
+    #  @return The number of items in the queue
+    @micropython.native
+    def num_in (self):
+        held = self._wr_idx - self._rd_idx
+        if held < 0:
+            held += self._slots
+        return held
+
+
+    ## Check if there are any items in the queue.
+    #  @return @c True if items are in the queue, @c False if not
+    @micropython.native
+    def any (self):
+        return self._wr_idx != self._rd_idx
+
+
+    ## Check if the queue is full.
+    #  @return @c True if there is no room for another item
+    @micropython.native
+    def full (self):
+        return self.num_in () >= self._size
+
+
+    ## Find the number of items there is room for.
+    @micropython.native
+    def _room (self):
+        return self._size - self.num_in ()
+
+
+    ## Record the largest number of items the queue has held. Only the 
+    #  producer calls this, with its new write index.
+    @micropython.native
+    def _note_fill (self, wr_idx):
+        held = wr_idx - self._rd_idx
+        if held < 0:
+            held += self._slots
+        if held > self._max_full:
+            self._max_full = held
+
+
+    ## Remove all contents from the queue. This may only be done when
+    #  neither the producer nor the consumer can be using the queue.
+    def clear (self):
+        self._rd_idx = 0
+        self._wr_idx = 0
+        self._max_full = 0
+
+
+    ## This method puts diagnostic information about the queue into a string.
+    def __repr__ (self):
+        return ('{:<12s} SPSCQueue<{:s}> Max Full {:d}/{:d}'.format (
+                self._name, type_code_strings[self._type_code], 
+                self._max_full, self._size))
+
+
+# ============================================================================
+
+## A block of named data fields which are written and read together.
+#
+#  When related values such as a velocity and a yaw rate setpoint are kept in
+#  separate shares, a reader may see the new value of one and the old value
+#  of the other if the writer is interrupted between its writes. A shared 
+#  block keeps all its fields in one @c array along with a sequence counter.
+#  The writer makes the counter odd before it changes any field and even 
+#  again when it is done. A reader copies the fields into its own buffer and
+#  then checks that the counter was even and has not changed; if it has, the
+#  copy may be torn and is made again. Neither side disables interrupts, and
+#  reading allocates no memory if the reader's buffer was made beforehand,
+#  for example with @c new_buffer(). 
+#
+#  The counter protects readers from a writer which is interrupted part way
+#  through a write, but not writers from each other, so two writes must 
+#  never overlap. Several tasks may write the same block, as the planner and
+#  the driving mode task both write the setpoints in @c main.py, since 
+#  cooperative tasks run one at a time and no write yields part way 
+#  through. An ISR or a task run from @c micropython.schedule() can 
+#  interrupt a task's write, though, so it must not write a block which 
+#  tasks also write. A reader in an ISR can't wait for an interrupted 
+#  writer to finish, so it makes one attempt and is told whether it 
+#  succeeded.
+#
+#  @code
+#  setpoint = task_share.SharedBlock ('f', ('velocity', 'yaw'), 
+#                                     name="Setpoint")
+#
+#  # In the writing task, publish both fields at once
+#  setpoint.put_fields (0.1, 0.0)
+#
+#  # In the reading task, make a buffer once and then take snapshots
+#  values = setpoint.new_buffer ()
+#  setpoint.get_into (values)
+#  velocity, yaw = values[0], values[1]
+#  @endcode
+class SharedBlock (BaseShare):
+
+    ## A counter used to give serial numbers to blocks for diagnostic use.
+    ser_num = 0
+
+    ## Create a shared block with the given fields, all starting at zero.
+    #  @param type_code The type of data in every field, as for a @c Share
+    #  @param fields A list or tuple of the names of the fields, in the order 
+    #         in which they are kept
+    #  @param name A short name for the block, default @c SharedBlockN where 
+    #         @c N is a serial number for the block
+    def __init__ (self, type_code, fields, name = None):
+        super ().__init__ (type_code, False, name)
+
+        self._fields = tuple (fields)
+        self._index = {field: idx for idx, field in enumerate (self._fields)}
+        self._count = len (self._fields)
+        self._buffer = array.array (type_code, [0] * self._count)
+        self._seq = 0                  # Odd while a write is in progress
+        self._retries = 0              # Number of torn reads made again
+
+        self._name = str (name) if name != None \
+            else 'SharedBlock' + str (SharedBlock.ser_num)
+        SharedBlock.ser_num += 1
+
+
+    ## Write every field of the block at once.
+    #  @param values A sequence holding a value for each field, in order
+    @micropython.native
+    def put (self, values):
+        buf = self._buffer
+        self._seq += 1
+        for idx in range (self._count):
+            buf[idx] = values[idx]
+        self._seq += 1
+
+
+    ## Write the first fields of the block at once from separate values.
+    #
+    #  The values are given as arguments, one for each field in order, so
+    #  the caller needs no list to hold them. Any number of values up to the
+    #  number of fields may be given; fields after the last value given are
+    #  left as they are.
+    #  @param values The values for the first fields, in order
+    #  @raise ValueError if more values are given than the block has fields
+    @micropython.native
+    def put_fields (self, *values):
+        count = len (values)
+        if count > self._count:
+            raise ValueError ('{:s} has only {:d} fields'.format (
+                              self._name, self._count))
+        buf = self._buffer
+        self._seq += 1
+        for idx in range (count):
+            buf[idx] = values[idx]
+        self._seq += 1
+
+
+    ## Write one field of the block, leaving the others as they are.
+    #  @param field The name or index of the field
+    #  @param value The new value for the field
+    @micropython.native
+    def put_field (self, field, value):
+        if not isinstance (field, int):
+            field = self._index[field]
+        self._seq += 1
+        self._buffer[field] = value
+        self._seq += 1
+
+
+    ## Copy a consistent snapshot of all the fields into a buffer.
+    #
+    #  If the block was written during the copy, the copy is made again 
+    #  unless the reader is an ISR, which can't wait for the writer.
+    #  @param buf An @c array or @c memoryview at least as long as the number 
+    #         of fields, into which the fields are copied in order
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return @c True if @c buf holds a consistent snapshot, or @c False if 
+    #          an ISR found a write in progress, in which case @c buf has not
+    #          been changed
+    @micropython.native
+    def get_into (self, buf, in_ISR = False):
+        data = self._buffer
+        while True:
+            seq = self._seq
+            if not seq & 1:
+                for idx in range (self._count):
+                    buf[idx] = data[idx]
+                if self._seq == seq:
+                    return True
+            if in_ISR:
+                return False
+            self._retries += 1
+
+
+    ## Read one field of the block. A single field is always read whole, 
+    #  but two fields read with two calls may come from different writes;
+    #  use @c get_into() to read fields which belong together.
+    #  @param field The name or index of the field
+    #  @return The value of the field
+    @micropython.native
+    def get (self, field):
+        if not isinstance (field, int):
+            field = self._index[field]
+        return self._buffer[field]
+
+
+    ## Find the index of a field, for reading a snapshot buffer.
+    #  @param field The name of the field
+    #  @return The index of the field in the block and in snapshot buffers
+    def index (self, field):
+        return self._index[field]
+
+
+    ## Make a buffer of the right type and size to hold a snapshot.
+    #  @return A new @c array with one item for each field
+    def new_buffer (self):
+        return array.array (self._type_code, [0] * self._count)
+
+
+    ## Puts diagnostic information about the block into a string, showing 
+    #  its fields and the number of reads which had to be made again.
+    def __repr__ (self):
+        return ('{:<12s} SharedBlock<{:s}> ({:s}) Retries {:d}'.format (
+                self._name, type_code_strings[self._type_code],
+                ', '.join (self._fields), self._retries))
+
+
 # ============================================================================
 
 ## An item which holds data to be shared between tasks.
@@ -354,11 +814,35 @@ class Share (BaseShare):
 
         self._buffer = array.array (type_code, [0])
 
+        # The tasks which are released when the share's value changes
+        self._subscribers = ()
+
+        # A count of the writes to the share, or of the changes in its value
+        # if it has subscribers, which lets readers find out whether it has
+        # changed since they last read it
+        self._version = 0
+
         self._name = str (name) if name != None \
             else 'Share' + str (Share.ser_num)
         Share.ser_num += 1
 
 
+    ## Subscribe a task to changes in the share's value.
+    #
+    #  Each time @c put() changes the value in the share, the @c go() method
+    #  of every subscribed task is called, so a task with no period runs only
+    #  when there is something new for it rather than checking the share 
+    #  every period. Writing the value which is already in the share does not
+    #  release the subscribers, and neither does a subscribed task's own 
+    #  write, so a task which lowers a flag it waits on still runs at its 
+    #  next period. Since @c go() only sets a flag, this also works when 
+    #  @c put() is called from an interrupt service routine.
+    #  Subscribe tasks before the scheduler starts, as this allocates memory.
+    #  @param task The task, a @c cotask.Task, to be released by changes
+    def subscribe (self, task):
+        self._subscribers += (task,)
+
+
     ## Write an item of data into the share.
     # 
     #  This method puts data into the share; any old data is overwritten.
@@ -374,12 +858,31 @@ class Share (BaseShare):
         if self._thread_protect and not in_ISR:
             irq_state = pyb.disable_irq ()
 
-        self._buffer[0] = data
+        # If tasks are subscribed, check for a change after the new value has
+        # been converted to the share's type. Reading the old value back 
+        # makes a new object for a float, so without subscribers every write
+        # is counted as a change rather than allocating on each write
+        if self._subscribers:
+            old = self._buffer[0]
+            self._buffer[0] = data
+            changed = self._buffer[0] != old
+        else:
+            self._buffer[0] = data
+            changed = True
+        if changed:
+            self._version = (self._version + 1) & 0x3FFFFFFF
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (irq_state)
 
+        # Release the subscribed tasks, except a task writing to the share
+        if changed and self._subscribers:
+            writer = None if in_ISR else _running_task ()
+            for task in self._subscribers:
+                if task is not writer:
+                    task.go ()
+
 
     ## Read an item of data from the share.
     # 
@@ -402,6 +905,62 @@ class Share (BaseShare):
         return (to_return)
 
 
+    ## Get the share's version, a count of the writes to the share. If tasks
+    #  are subscribed to the share, only writes which change its value are 
+    #  counted, so writing the value which is already there does not change
+    #  the version. Without subscribers the value is not compared, so that 
+    #  writing a float share allocates no memory.
+    #  A reader keeps the version from its last read and compares it with 
+    #  @c changed_since() or reads with @c get_if_changed() to skip work when
+    #  the value has not moved.
+    #  @return The version, which wraps around to zero after 0x3FFFFFFF
+    @micropython.native
+    def version (self):
+        return self._version
+
+
+    ## Check whether the share has a new version since a given version, as 
+    #  counted by @c version().
+    #  @param version A version from @c version() or @c get_if_changed()
+    #  @return @c True if the value has changed since that version
+    @micropython.native
+    def changed_since (self, version):
+        return self._version != version
+
+
+    ## Read the share only if it has a new version since a given version, as
+    #  counted by @c version().
+    #
+    #  @code
+    #  last = my_share.version ()
+    #  while True:
+    #      new = my_share.get_if_changed (last)
+    #      if new is not None:
+    #          value, last = new
+    #          recompute_with (value)
+    #      yield 0
+    #  @endcode
+    #  @param version A version from an earlier call or from @c version()
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return A tuple of the value and its version if the value has changed,
+    #          or @c None if it has not
+    @micropython.native
+    def get_if_changed (self, version, in_ISR = False):
+        if self._version == version:
+            return None
+
+        # Read the value and its version together
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        to_return = (self._buffer[0], self._version)
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return to_return
+
+
     ## Puts diagnostic information about the share into a string.
     #
     #  Shares are pretty simple, so we just put the name and type. 
@@ -0,0 +1,36 @@
+"""!
+@file ticks_compat.py
+@brief The tick functions used by modules which also run on a PC.
+@details On the board ticks_us(), ticks_ms() and ticks_diff() come from utime. On a PC
+         without utime, such as under CPython, equivalents are defined here which treat
+         tick values as wrapping at 2**30, as the MicroPython ports do, so timestamps from
+         an emulator or virtual clock give the same differences on both. This module can
+         stand in for utime itself where only these three are used.
+@author Colin Bentley and Jack Maxwell
+@date 12/13/2024
+"""
+
+try:
+    from utime import ticks_us, ticks_ms, ticks_diff
+except ImportError:
+    from time import perf_counter_ns
+
+    ticks_period = 1 << 30       # tick values wrap around to zero at this count
+
+    def ticks_us():
+        '''!@brief Gets a wrapping microsecond tick count.
+        '''
+        return (perf_counter_ns() // 1000) & (ticks_period - 1)
+
+    def ticks_ms():
+        '''!@brief Gets a wrapping millisecond tick count.
+        '''
+        return (perf_counter_ns() // 1000000) & (ticks_period - 1)
+
+    def ticks_diff(new, old):
+        '''!@brief Finds the signed difference between two wrapping tick values.
+        @param new the later tick value
+        @param old the earlier tick value
+        @return new - old, correct across a wrap as long as it is less than half a period
+        '''
+        return ((new - old + ticks_period // 2) & (ticks_period - 1)) - ticks_period // 2